@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+asyncio based feeders. Instead of polling non-blocking files from a timer
+they wake up exactly when bytes arrive on stdin, a TCP socket or a serial
+device, decode them with the ModEEG decoder and publish the samples.
+
+The event loop either runs on a background thread next to the viewer
+(StreamFeeder.start) or drives a headless process (run_headless).
+"""
+import os
+import sys
+import asyncio
+import threading
+
+from buffers import SampleRing
+from feeders import ModEEGDecoder, MODEEG_CHANNELS, READ_SIZE, \
+        CollectorSlots, configure_serial, add_source_arguments
+
+async def pipe_reader(fileobj):
+    " StreamReader for a pipe, tty or other non-regular file object "
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=READ_SIZE)
+    await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), fileobj)
+    return reader
+
+def run_in_background(source):
+    " Run the coroutine source on a new event loop in a daemon thread "
+    thread = threading.Thread(target=asyncio.run, args=(source,))
+    thread.daemon = True
+    thread.start()
+    return thread
+
+def open_serial(path, baud=57600):
+    " Open a serial device (or pty) in raw mode for non-blocking reads "
+    fd = os.open(path, os.O_RDONLY | os.O_NOCTTY | os.O_NONBLOCK)
+    if os.isatty(fd):
+        configure_serial(fd, baud)
+    return os.fdopen(fd, 'rb', 0)
+
+class StreamFeeder(object):
+    """
+    Feeder that decodes a ModEEG byte stream read by asyncio. Decoded
+    blocks go into a SampleRing, so calling the feeder drains them without
+    blocking just like ThreadedFeeder, and to any callbacks registered
+    with subscribe(), which run on the event loop.
+    """
+
+    def __init__(self, fill=None, capacity=65536):
+        self.fill = fill
+        self.decoder = ModEEGDecoder(fill)
+        self.ring = SampleRing(capacity, MODEEG_CHANNELS, 'drop-oldest')
+        self.callbacks = []
+        self.thread = None
+        self.connections = 0
+
+    def subscribe(self, callback):
+        self.callbacks.append(callback)
+
+    async def consume(self, reader):
+        " Decode everything from reader until it reaches end of file "
+        while True:
+            data = await reader.read(READ_SIZE)
+            if not data:
+                break
+            block = self.decoder.samples(data)
+            if len(block):
+                self.ring.write(block)
+                for callback in self.callbacks:
+                    callback(block)
+
+    async def read_stdin(self):
+        await self.consume(await pipe_reader(sys.stdin.buffer))
+
+    async def read_serial(self, path):
+        await self.consume(await pipe_reader(open_serial(path)))
+
+    async def read_tcp(self, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            await self.consume(reader)
+        finally:
+            writer.close()
+
+    async def listen(self, port, host=None):
+        """
+        Accept collectors connecting on port, like `nc -l` did. Connections
+        are served one after another, each with a fresh decoder, so a
+        partial packet or the packet counter of the previous collector do
+        not leak into the next stream.
+        """
+        busy = asyncio.Lock()
+        async def handle(reader, writer):
+            async with busy:
+                self.connections += 1
+                self.decoder = ModEEGDecoder(self.fill)
+                try:
+                    await self.consume(reader)
+                finally:
+                    writer.close()
+        server = await asyncio.start_server(handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def start(self, source):
+        """
+        Run the coroutine source, e.g. feeder.read_tcp(host, port), on an
+        event loop in a background thread.
+        """
+        self.thread = run_in_background(source)
+        return self
+
+    def __call__(self):
+        return self.ring.read()
+
+    def stats(self):
+        stats = self.decoder.stats()
+        stats.update({
+            'samples': self.ring.head,
+            'overruns': self.ring.overruns,
+            'connections': self.connections,
+        })
+        return stats
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        self.server._datagram(data, addr)
+
+class CollectorServer(CollectorSlots):
+    """
+    CollectorSlots served by asyncio, for the headless tool; the viewer
+    uses the thread based feeders.CollectorServer.
+    """
+
+    async def _connection(self, reader, writer):
+        c = self._acquire(writer.get_extra_info('peername'))
+        if c is None:
+            writer.close()
+            return
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                self._feed(c, data)
+        finally:
+            c.reset(None)
+            writer.close()
+
+    async def serve(self, port, host=None, udp=True):
+        loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self._connection, host, port)
+        transport = None
+        if udp:
+            transport, _ = await loop.create_datagram_endpoint(
+                    lambda: _DatagramProtocol(self),
+                    local_addr=(host or '0.0.0.0', port))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if transport is not None:
+                transport.close()
+
+    def start(self, port, host=None, udp=True):
+        " Serve on a background event loop thread "
+        self.thread = run_in_background(self.serve(port, host, udp))
+        return self
+
+async def _report(feeder, interval):
+    while True:
+        await asyncio.sleep(interval)
+        print(feeder.stats())
+
+async def _headless(feeder, source, interval, ts=None):
+    report = asyncio.ensure_future(_report(feeder, interval))
+    try:
+        await source
+    finally:
+        report.cancel()
+    print(feeder.stats())
+    if ts is not None:
+        print(ts.timings())
+
+def run_headless(feeder, source, ts=None, interval=1.0):
+    """
+    Run source without a window, printing ingest statistics every
+    `interval` seconds. If a TimeSeries is given it eats every block as
+    soon as it arrives, and the time spent in its pipeline stages is
+    printed at the end.
+    """
+    if ts is not None:
+        feeder.subscribe(lambda block: ts.eat())
+    asyncio.run(_headless(feeder, source, interval, ts))
+
+def parse_source(feeder, args):
+    " The coroutine for the source selected by --tcp, --listen or --serial "
+    if isinstance(feeder, CollectorServer):
+        return feeder.serve(args.listen)
+    if args.tcp:
+        host, port = args.tcp.rsplit(':', 1)
+        return feeder.read_tcp(host, int(port))
+    if args.listen:
+        return feeder.listen(args.listen)
+    if getattr(args, 'serial', None):
+        return feeder.read_serial(args.serial)
+    return feeder.read_stdin()
+
+def make_feeder(args):
+    " A CollectorServer for --listen with --collectors, a StreamFeeder else "
+    if args.listen and args.collectors:
+        return CollectorServer(args.collectors)
+    return StreamFeeder()
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+            description='Headless ModEEG ingest, reads stdin by default')
+    add_source_arguments(parser)
+    parser.add_argument('--analyze', action='store_true',
+            help='run the analysis model on the incoming data')
+    parser.add_argument('--interval', type=float, default=1.0,
+            help='seconds between statistics reports')
+    args = parser.parse_args()
+
+    feeder = make_feeder(args)
+    ts = None
+    if args.analyze:
+        from model import TimeSeries
+        ts = TimeSeries(feeder, getattr(feeder, 'channels', MODEEG_CHANNELS))
+        ts.subscribe('spectrogram')
+        ts.subscribe('bands')
+    run_headless(feeder, parse_source(feeder, args), ts, args.interval)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Headless batch analysis of recorded sessions.
+
+Runs a recording (a dantien recording or a raw ModEEG dump) through the
+same decimation, STFT, band power and optionally wavelet stages as the
+viewer, and writes the products to .npy files in the layout of
+TimeSeries.dat_s, dat_b and dat_w: (channels, rows, columns).
+
+Long recordings are cut into chunks that are analyzed in parallel by a
+multiprocessing pool. Every chunk starts early by enough samples for all
+filter state to settle and drops the columns of that overlap, and chunk
+boundaries fall on the column grid of the whole stream, so the result is
+the same as analyzing the recording in one go.
+"""
+import numpy as np
+from multiprocessing import Pool
+
+from model import TimeSeries
+from dsp import parse_filters
+
+def _gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return a
+
+class Source(object):
+    " Random access to the samples of a recording, scaled like the feeders "
+
+    def __init__(self, path):
+        from recording import MAGIC
+        with open(path, 'rb') as f:
+            magic = f.read(len(MAGIC))
+        if magic == MAGIC:
+            from recording import RecordingReader
+            self.recording = RecordingReader(path)
+            self.channels = self.recording.channels
+            self.rate = self.recording.rate
+            self.length = len(self.recording)
+        else:
+            from feeders import ModEEGReplay, MODEEG_CHANNELS
+            self.recording = ModEEGReplay(path, speed=None)
+            self.channels = MODEEG_CHANNELS
+            self.rate = self.recording.rate
+            self.length = len(self.recording)
+
+    def read(self, start, stop):
+        " Samples start..stop as a float32 (samples, channels) array "
+        from feeders import ModEEGReplay, modeeg_samples
+        if isinstance(self.recording, ModEEGReplay):
+            return modeeg_samples(self.recording.packets(start, stop))
+        samples = self.recording.read(start, stop)[0]
+        if samples.dtype == np.uint16:
+            # ModEEG channel values, see feeders.modeeg_samples
+            return (samples.astype(np.float32) - 512) / 1024.0
+        return samples.astype(np.float32)
+
+class BatchAnalysis(object):
+    """
+    Chunk layout and output files for analyzing one recording with the
+    parameters of a TimeSeries class.
+    """
+
+    def __init__(self, path, prefix, params=None, chunk=600.0,
+                 scaleogram=False):
+        self.path = path
+        self.params = params or {}
+        self.scaleogram = scaleogram
+        self._open()
+        ts = self.ts
+        self.stride = ts.wavelet.stride
+        # chunks start on multiples of `unit` input samples, which keeps
+        # the decimation phase and the column grids of the whole stream
+        step = ts.hop * ts.wavelet.stride // _gcd(ts.hop, ts.wavelet.stride)
+        self.unit = ts.zoom * step
+        self.chunk = max(int(chunk * self.source.rate) // self.unit, 1) * self.unit
+        self.overlap = -(-self._warmup(ts) // self.unit) * self.unit
+
+        n = -(-self.source.length // ts.zoom) # decimated samples
+        nb = -(-self.source.length // ts.band_zoom)
+        self.outputs = {
+            'spectrogram': (ts.window_size, self._columns(n, ts.hop)),
+            'bands': (len(ts.bands), self._columns(nb, ts.band_hop)),
+        }
+        if scaleogram:
+            self.outputs['scaleogram'] = (2 ** ts.wavelet.level,
+                                          self._columns(n, self.stride))
+        self.files = {}
+        for name, (rows, columns) in self.outputs.items():
+            self.files[name] = '%s.%s.npy' % (prefix, name)
+            np.lib.format.open_memmap(self.files[name], mode='w+',
+                    dtype=np.float32,
+                    shape=(self.source.channels, rows, columns)).flush()
+
+    def _open(self):
+        self.source = Source(self.path)
+        self.ts = series_class(**self.params)(None, self.source.channels,
+                                              rate=self.source.rate)
+
+    # workers get a copy without the open recording, see _init
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['source'], state['ts']
+        return state
+
+    @staticmethod
+    def _columns(n, step):
+        " Columns of a stream of n samples with one column every step "
+        return (n - 1) // step + 1 if n > 0 else 0
+
+    def _warmup(self, ts):
+        " Input samples after which the output no longer depends on the start "
+        frames = ts.window_size - 1
+        branches = [(ts.decimator, ts.zoom, frames),
+                    (ts.band_decimator, ts.band_zoom, frames)]
+        if self.scaleogram:
+            support = sum(len(lo) - 1 for lo, _ in ts.wavelet.filters)
+            branches.append((ts.decimator, ts.zoom, support))
+        # the spectrogram and the band powers have their own decimators
+        warmup = 0
+        for decimator, zoom, frames in branches:
+            memory, q = 0, 1
+            for stage in decimator.stages:
+                # FIR stages remember their taps; let IIR transients decay
+                taps = len(stage.taps) - 1 if hasattr(stage, 'taps') else 100 * stage.q
+                memory += taps * q
+                q *= stage.q
+            warmup = max(warmup, memory + frames * zoom)
+        return ts.filter.settle() + warmup
+
+    def chunks(self):
+        return [(start, min(start + self.chunk, self.source.length))
+                for start in range(0, self.source.length, self.chunk)]
+
+    def process(self, start, stop):
+        " Analyze samples start..stop and write their columns to the outputs "
+        ts = self.ts
+        ts.reset()
+        first = max(start - self.overlap, 0)
+        blocks = ts.preprocess(self.source.read(first, stop))
+        spectrogram, bands = ts.analyze(blocks)
+        # columns and the input samples between them
+        products = {'spectrogram': (spectrogram, ts.zoom * ts.hop),
+                    'bands': (bands, ts.band_zoom * ts.band_hop)}
+        if self.scaleogram:
+            products['scaleogram'] = (ts.wavelet.process(blocks['series']),
+                                      ts.zoom * self.stride)
+        for name, (columns, step) in products.items():
+            skip = (start - first) // step
+            offset = start // step
+            columns = columns[..., skip:]
+            out = np.load(self.files[name], mmap_mode='r+')
+            out[..., offset:offset + columns.shape[-1]] = columns
+            out.flush()
+            del out
+        return start, stop
+
+_analysis = None
+
+def _init(analysis):
+    global _analysis
+    # forked workers would share the parent's file offsets, so every
+    # worker opens the recording itself
+    analysis._open()
+    _analysis = analysis
+
+def _process(chunk):
+    return _analysis.process(*chunk)
+
+def run(analysis, processes=None, verbose=False):
+    " Analyze all chunks of analysis on a pool of processes "
+    chunks = analysis.chunks()
+    pool = Pool(processes, _init, (analysis,))
+    try:
+        for i, (start, stop) in enumerate(pool.imap_unordered(_process, chunks)):
+            if verbose:
+                print('%d/%d chunks, samples %d..%d' %
+                      (i + 1, len(chunks), start, stop))
+    finally:
+        pool.close()
+        pool.join()
+    return analysis.files
+
+def series_class(**params):
+    " A TimeSeries subclass with the given class attributes overridden "
+    params = dict((k, v) for k, v in params.items() if v is not None)
+    if not params:
+        return TimeSeries
+    return type('BatchSeries', (TimeSeries,), params)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+            description='Analyze a recording into spectrogram, band power '
+                        'and scaleogram .npy files')
+    parser.add_argument('recording')
+    parser.add_argument('prefix', nargs='?',
+            help='output file prefix, defaults to the recording path')
+    parser.add_argument('--chunk', type=float, default=600.0,
+            metavar='SECONDS', help='length of the chunks analyzed in parallel')
+    parser.add_argument('--processes', type=int,
+            help='worker processes, defaults to the number of CPUs')
+    parser.add_argument('--scaleogram', action='store_true',
+            help='compute the wavelet scaleogram as well')
+    parser.add_argument('--zoom', type=int,
+            help='decimation factor, see TimeSeries.zoom')
+    parser.add_argument('--hop', type=int,
+            help='samples between spectrogram columns, see TimeSeries.hop')
+    parser.add_argument('--window', dest='window_name',
+            help='STFT window, one of pytfd.windows')
+    parser.add_argument('--filters', type=parse_filters, metavar='NAMES',
+            help='comma separated filter presets (see dsp.FILTER_PRESETS) '
+                 'or "none"')
+    parser.add_argument('-q', '--quiet', action='store_true')
+    args = parser.parse_args()
+
+    params = {'zoom': args.zoom, 'hop': args.hop,
+              'window_name': args.window_name, 'filters': args.filters}
+    analysis = BatchAnalysis(args.recording, args.prefix or args.recording,
+                             params, args.chunk, args.scaleogram)
+    for name in sorted(run(analysis, args.processes, not args.quiet).values()):
+        print(name)
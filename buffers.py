@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+"""
+Preallocated buffers that sit between acquisition, analysis and display.
+"""
+import threading
+import numpy as np
+
+class SampleRing(object):
+    """
+    Single-producer/single-consumer ring buffer of (samples, channels)
+    blocks. The producer only ever advances `head` and the consumer only
+    ever advances `tail`, so neither side needs a lock.
+
+    With overflow='drop-oldest' the producer overwrites samples that were
+    not read in time and the consumer skips them, counting them in
+    `overruns`. With overflow='block' the producer waits for free space.
+    """
+    policies = ('drop-oldest', 'block')
+
+    def __init__(self, capacity, channels, overflow='drop-oldest',
+                 dtype=np.float32):
+        if overflow not in self.policies:
+            raise ValueError("overflow must be one of %r" % (self.policies,))
+        self.capacity = capacity
+        self.overflow = overflow
+        self.buf = np.zeros((capacity, channels), dtype=dtype)
+        self.head = 0 # total samples written, owned by the producer
+        self.reserved = 0 # end of the block the producer is copying in
+        self.tail = 0 # total samples read, owned by the consumer
+        self.lost = 0 # samples skipped by the consumer
+        self.truncated = 0 # samples dropped by the producer
+        self.blocked = 0
+        self.closed = False
+        self._space = threading.Event()
+
+    @property
+    def overruns(self):
+        " Number of samples lost because the consumer fell behind "
+        return self.lost + self.truncated
+
+    def __len__(self):
+        return min(self.head - self.tail, self.capacity)
+
+    def _copy_in(self, block, start):
+        i = start % self.capacity
+        n = min(len(block), self.capacity - i)
+        self.buf[i:i + n] = block[:n]
+        self.buf[:len(block) - n] = block[n:]
+
+    def _copy_out(self, start, stop):
+        i = start % self.capacity
+        n = stop - start
+        if i + n <= self.capacity:
+            return self.buf[i:i + n].copy()
+        return np.concatenate((self.buf[i:], self.buf[:i + n - self.capacity]))
+
+    def write(self, block):
+        " Append a block of samples; called from the producer thread only "
+        if len(block) > self.capacity:
+            self.truncated += len(block) - self.capacity
+            block = block[-self.capacity:]
+        if self.overflow == 'block':
+            while self.capacity - (self.head - self.tail) < len(block):
+                if self.closed:
+                    return
+                self.blocked += 1
+                self._space.clear()
+                if self.capacity - (self.head - self.tail) < len(block):
+                    self._space.wait(0.1)
+        self.reserved = self.head + len(block)
+        self._copy_in(block, self.head)
+        self.head = self.reserved
+
+    def read(self):
+        " Take everything written so far; never blocks "
+        head = self.head
+        tail = self.tail
+        if head - tail > self.capacity:
+            self.lost += head - tail - self.capacity
+            tail = head - self.capacity
+        out = self._copy_out(tail, head)
+        # the producer may have lapped us while we were copying
+        lapped = self.reserved - self.capacity - tail
+        if lapped > 0:
+            self.lost += lapped
+            out = out[lapped:]
+        self.tail = head
+        self._space.set()
+        return out
+
+    def close(self):
+        self.closed = True
+        self._space.set()
+
+class MirroredRing(object):
+    """
+    Fixed-length history of (samples, channels) data. Every sample is
+    stored twice, N rows apart, so the last n samples are always one
+    contiguous slice: writes cost two copies of the new samples only and
+    view() never copies.
+    """
+
+    def __init__(self, length, channels, dtype=np.float32):
+        self.length = length
+        self.buf = np.zeros((2 * length, channels), dtype=dtype)
+        self.pos = 0 # where the next sample goes, always < length
+
+    def __len__(self):
+        return self.length
+
+    def write(self, block):
+        block = block[-self.length:]
+        n = len(block)
+        first = min(n, self.length - self.pos)
+        for offset in (0, self.length):
+            start = self.pos + offset
+            self.buf[start:start + first] = block[:first]
+        # the rest wraps around to the front of both copies
+        rest = n - first
+        self.buf[:rest] = block[first:]
+        self.buf[self.length:self.length + rest] = block[first:]
+        self.pos = (self.pos + n) % self.length
+
+    def view(self, n=None):
+        " The last n (default all) samples, oldest first, without copying "
+        if n is None or n > self.length:
+            n = self.length
+        end = self.pos + self.length
+        return self.buf[end - n:end]
+
+class ColumnRing(object):
+    """
+    Circular history of (channels, rows) columns, e.g. spectrogram frames.
+    Columns are written in place at a moving cursor instead of shifting the
+    whole history, so an update costs as much as the columns it touches.
+    The oldest column is at `cursor`; consumers that can deal with the
+    wrap-around (like textures drawn with a coordinate offset) use `buf`
+    and `cursor` directly, ordered() returns a chronological copy.
+    """
+
+    def __init__(self, channels, rows, length, dtype=np.float64):
+        self.length = length
+        self.buf = np.zeros((channels, rows, length), dtype=dtype)
+        self.cursor = 0
+
+    @property
+    def shape(self):
+        return self.buf.shape
+
+    def advance(self, n):
+        " Make room for n new columns; the n oldest ones are given up "
+        self.cursor = (self.cursor + n) % self.length
+
+    def push(self, columns):
+        " Append new columns, giving up as many old ones "
+        self.advance(columns.shape[-1])
+        self.set_last(columns)
+
+    def _slices(self, k):
+        " Buffer slices holding the last k columns, oldest first "
+        start = (self.cursor - k) % self.length
+        if start + k <= self.length:
+            return [slice(start, start + k)]
+        return [slice(start, self.length), slice(0, start + k - self.length)]
+
+    def set_last(self, columns):
+        " Overwrite the newest columns with columns[..., -k:] "
+        columns = columns[..., -self.length:]
+        i = 0
+        for s in self._slices(columns.shape[-1]):
+            n = s.stop - s.start
+            self.buf[..., s] = columns[..., i:i + n]
+            i += n
+
+    def last(self, k):
+        " Copy of the newest k columns in chronological order "
+        return np.concatenate([self.buf[..., s] for s in self._slices(k)],
+                              axis=-1)
+
+    def ordered(self):
+        return self.last(self.length)
+
+class DoubleBuffer(object):
+    """
+    Two ColumnRings, so that one thread can update a product while others
+    read the last complete version of it without locking. The writer
+    pushes columns into `back`; publish() swaps it with `front`, which
+    readers use. Columns the new back ring missed are replayed onto it on
+    the next push, which leaves readers of the old front ring a full
+    update cycle to finish with it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.front = ColumnRing(*args, **kwargs)
+        self.back = ColumnRing(*args, **kwargs)
+        self.written = []
+        self.missed = []
+
+    def push(self, columns):
+        for c in self.missed:
+            self.back.push(c)
+        self.missed = []
+        self.back.push(columns)
+        self.written.append(columns)
+
+    def publish(self):
+        self.front, self.back = self.back, self.front
+        self.missed, self.written = self.written, []
+
+class OverlapBuffer(object):
+    """
+    The samples of a (samples, channels) stream that must be processed
+    again with the next block, like the start of an unfinished STFT frame
+    or the history of a FIR filter. extend() appends a block and returns
+    the kept samples and the block as one array, consume() gives up the
+    oldest samples. Two preallocated arrays take turns, so neither call
+    allocates once they are large enough for the blocks.
+    """
+
+    def __init__(self, keep, channels, dtype=np.float64):
+        # the stream is taken to be preceded by keep zeros
+        self.buffers = [np.zeros((keep, channels), dtype=dtype),
+                        np.zeros((keep, channels), dtype=dtype)]
+        self.n = keep
+
+    def __len__(self):
+        return self.n
+
+    def extend(self, block):
+        " Kept samples followed by block, valid until the next consume() "
+        buf = self.buffers[0]
+        need = self.n + len(block)
+        if len(buf) < need:
+            grown = np.empty((max(need, 2 * len(buf)), buf.shape[1]),
+                             dtype=buf.dtype)
+            grown[:self.n] = buf[:self.n]
+            buf = self.buffers[0] = grown
+        buf[self.n:need] = block
+        self.n = need
+        return buf[:need]
+
+    def consume(self, k):
+        " Give up the oldest k samples "
+        src, dst = self.buffers
+        rest = self.n - k
+        if len(dst) < rest:
+            dst = np.empty_like(src)
+        dst[:rest] = src[k:self.n]
+        self.buffers = [dst, src]
+        self.n = rest
+
+class HistoryPyramid(object):
+    """
+    Long history of (channels, rows) columns in bounded memory. Level 0
+    keeps the newest `length` columns at full resolution; every further
+    level keeps `length` columns, each pooling `factor` columns of the
+    level below by mean or max, so level l reaches factor**l times as far
+    back. Queries read from the finest level that still holds the start
+    of the requested range at the requested width.
+
+    Levels store whole columns contiguously, (length, channels, rows), so
+    a push only touches the memory of the columns it writes. with_budget()
+    sizes the levels to a number of bytes.
+    """
+    reductions = {'mean': np.mean, 'max': np.max}
+
+    def __init__(self, channels, rows, length=4096, levels=6, factor=4,
+                 reduce='mean', dtype=np.float32):
+        # incomplete coarse columns are pooled from level 0, which must
+        # hold a whole group of the coarsest level
+        if length < factor ** (levels - 1):
+            raise ValueError("%d levels with factor %d need a length of at "
+                             "least %d" % (levels, factor,
+                                           factor ** (levels - 1)))
+        self.length = length
+        self.factor = factor
+        self.reduce = self.reductions[reduce]
+        self.levels = [np.zeros((length, channels, rows), dtype=dtype)
+                       for _ in range(levels)]
+        self.counts = [0] * levels # columns ever written to each level
+        # columns of each level that do not make up a full group yet
+        self.pending = [np.zeros((channels, rows, 0), dtype=dtype)
+                        for _ in range(levels)]
+        self.lock = threading.Lock()
+
+    @classmethod
+    def with_budget(cls, nbytes, channels, rows, levels=6, factor=4,
+                    dtype=np.float32, **kwargs):
+        """
+        A pyramid of at most about nbytes. Levels are given up while the
+        budget is too small for them to be useful (see __init__).
+        """
+        column = channels * rows * np.dtype(dtype).itemsize
+        while True:
+            length = max(nbytes // (levels * column), 1)
+            if levels == 1 or length >= factor ** (levels - 1):
+                break
+            levels -= 1
+        return cls(channels, rows, length, levels, factor, dtype=dtype,
+                   **kwargs)
+
+    def __len__(self):
+        " Number of full resolution columns pushed so far "
+        return self.counts[0]
+
+    def _pool(self, columns, f=None):
+        " Reduce groups of f columns, a trailing partial group as well "
+        f = f or self.factor
+        n = columns.shape[-1]
+        g = n // f
+        full = columns[..., :g * f].reshape(columns.shape[:-1] + (g, f))
+        parts = [self.reduce(full, axis=-1)]
+        if n > g * f:
+            parts.append(self.reduce(columns[..., g * f:], axis=-1)[..., None])
+        return np.concatenate(parts, axis=-1).astype(columns.dtype)
+
+    def _write(self, l, columns):
+        n = columns.shape[-1]
+        new = columns[..., -self.length:].transpose(2, 0, 1)
+        self.levels[l][(self.counts[l] + np.arange(n - len(new), n))
+                       % self.length] = new
+        self.counts[l] += n
+
+    def push(self, columns):
+        with self.lock:
+            for l in range(len(self.levels)):
+                self._write(l, columns)
+                if l + 1 == len(self.levels):
+                    break
+                data = np.concatenate((self.pending[l], columns), axis=-1)
+                g = data.shape[-1] // self.factor * self.factor
+                self.pending[l] = data[..., g:]
+                if g == 0:
+                    break
+                columns = self._pool(data[..., :g])
+
+    def _read(self, l, j0, j1):
+        """
+        Columns j0..j1 of level l. Columns that are not complete at this
+        level yet are pooled from the full resolution columns on the fly,
+        so that a partial mean weighs every column the same.
+        """
+        level, count = self.levels[l], self.counts[l]
+        j0 = max(j0, count - self.length, 0)
+        parts = []
+        if min(j1, count) > j0:
+            j = np.arange(j0, min(j1, count))
+            parts.append(level[j % self.length].transpose(1, 2, 0))
+        if j1 > count and l > 0:
+            f = self.factor ** l
+            finer = self._read(0, max(j0, count) * f, j1 * f)
+            if finer.shape[-1]:
+                parts.append(self._pool(finer, f))
+        if not parts:
+            return level[:0].transpose(1, 2, 0).copy()
+        return np.concatenate(parts, axis=-1)
+
+    def query(self, start, stop, width=None):
+        """
+        Full resolution columns start..stop (counted from the first push)
+        at no more than about `width` columns. Returns the columns and the
+        step, the number of full resolution columns each one pools; the
+        first one starts at start // step * step. Parts of the range that
+        are older than the coarsest level are left out.
+        """
+        start, stop = max(start, 0), min(stop, len(self))
+        with self.lock:
+            for l in range(len(self.levels)):
+                step = self.factor ** l
+                oldest = (self.counts[l] - self.length) * step
+                if start >= oldest and (width is None or
+                                        -(-(stop - start) // step) <= width):
+                    break
+            return self._read(l, start // step, -(-stop // step)), step
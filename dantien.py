@@ -5,8 +5,10 @@ Dantien application
 from itertools import product
 import glumpy
 
-def dantien(feed_func, layout, update_rate=5):
-    ts = TimeSeries(feed_func)
+def dantien(feed_func, layout, update_rate=5, channels=1, filters=None,
+            rate=None):
+    ts = TimeSeries(feed_func, channels, threaded=True, filters=filters,
+                    rate=rate)
 
     cols = len(layout[0])
     rows = len(layout)
@@ -29,21 +31,73 @@ def dantien(feed_func, layout, update_rate=5):
 
 if __name__ == '__main__':
     import sys
+    import argparse
     from views import Cube, Spectrogram, SeriesPlot, FFTPlot, \
-            Spectrogram3D, Scaleogram, Blank as _, SpectrogramAxis
+            Spectrogram3D, Scaleogram, Blank as _, SpectrogramAxis, \
+            BandPowerPlot
     from model import TimeSeries
+    from dsp import parse_filters
     import feeders
 
-    if len(sys.argv) >= 2 and sys.argv[1] == '--modeeg':
-        feed = feeders.mk_modeeg(sys.stdin) # read modeeg data from stdin
+    parser = argparse.ArgumentParser(description='OpenGL brainwave visualizer')
+    parser.add_argument('--modeeg', action='store_true',
+            help='read ModEEG data from stdin')
+    parser.add_argument('--replay', metavar='FILE',
+            help='replay a recorded ModEEG dump')
+    parser.add_argument('--seek', type=float, default=0.0, metavar='SECONDS',
+            help='start the replay at this point')
+    parser.add_argument('--speed', type=float, default=1.0,
+            help='replay speed as a multiple of real time, 0 for maximum')
+    parser.add_argument('--synthetic', type=int, metavar='CHANNELS',
+            help='show a synthetic test signal with this many channels')
+    parser.add_argument('--rate', type=float, default=256.0,
+            help='sample rate of the synthetic signal')
+    feeders.add_source_arguments(parser)
+    parser.add_argument('--filters', type=parse_filters, metavar='NAMES',
+            help='comma separated filter presets applied before the '
+                 'analysis (see dsp.FILTER_PRESETS) or "none", defaults '
+                 'to dc,mains50')
+    args = parser.parse_args()
+
+    channels = 1
+    if args.replay:
+        channels = feeders.MODEEG_CHANNELS
+        feed = feeders.ModEEGReplay(args.replay, speed=args.speed or None)
+        feed.seek(args.seek)
+    elif args.listen:
+        # one slot per collector, a single one without --collectors
+        feed = feeders.CollectorServer(max(args.collectors, 1))
+        feed.start(args.listen)
+        channels = feed.channels
+    elif args.tcp:
+        host, port = args.tcp.rsplit(':', 1)
+        channels = feeders.MODEEG_CHANNELS
+        feed = feeders.ThreadedFeeder(feeders.TCPFeeder(host, int(port)),
+                                      channels)
+    elif args.synthetic:
+        channels = args.synthetic
+        feed = feeders.SyntheticFeeder(channels, args.rate)
+    elif args.serial:
+        channels = feeders.MODEEG_CHANNELS
+        feed = feeders.ThreadedFeeder(feeders.SerialFeeder(args.serial),
+                                      channels)
+    elif args.modeeg:
+        # read modeeg data from stdin on a separate thread
+        channels = feeders.MODEEG_CHANNELS
+        feed = feeders.ThreadedFeeder(
+                feeders.mk_modeeg(sys.stdin, blocking=True), channels)
     else:
         feed = feeders.random_positive_sinoids
 
     layout = [
 #        [FFTPlot, SeriesPlot],
+#        [BandPowerPlot, _],
         [SpectrogramAxis, Spectrogram],
 #        [Spectrogram3D, _], #Scaleogram],
     ]
 
-    dantien(feed, layout)
+    # feeds that know their sample rate (replays, the synthetic signal)
+    # set it, ModEEG hardware runs at the TimeSeries default
+    dantien(feed, layout, channels=channels, filters=args.filters,
+            rate=getattr(feed, 'rate', None))
 
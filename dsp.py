@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming signal processing stages. Every stage keeps its state between
+calls so that a stream can be processed block by block, with all channels
+of a (samples, channels) block handled in one vectorized call.
+"""
+import numpy as np
+import pywt
+from numpy.lib.stride_tricks import as_strided
+from scipy.fftpack import rfft
+from scipy import signal
+
+from pytfd.plans import Plan
+from buffers import OverlapBuffer
+
+class StreamingSTFT(object):
+    """
+    Short-time Fourier transform of a multichannel stream. Frames of
+    len(window) samples start every `hop` samples; process() only
+    transforms the frames completed by the new samples, all in one batched
+    FFT, and keeps the overlap for the next call.
+
+    Columns use the layout of pytfd.stft.spectogram: the magnitude of the
+    real FFT in packed order, (channels, len(window), frames). The stream
+    is taken to be preceded by zeros, so the first frame completes with
+    the first sample.
+
+    window is a pytfd.plans.Plan, or an array for which a private plan is
+    made. The windowed frames are formed in the plan's scratch buffer and
+    the overlap is kept in an OverlapBuffer, so neither is allocated per
+    call.
+    """
+
+    def __init__(self, window, channels, hop=1):
+        if not isinstance(window, Plan):
+            window = Plan('rfft', len(window), window, np.float64, 1.0)
+        self.plan = window
+        self.window = window.window
+        self.hop = hop
+        self.overlap = OverlapBuffer(len(self.window) - 1, channels)
+
+    def process(self, block):
+        T = len(self.window)
+        buf = self.overlap.extend(block)
+        count = (len(buf) - T) // self.hop + 1 if len(buf) >= T else 0
+        s0, s1 = buf.strides
+        frames = as_strided(buf, shape=(count, buf.shape[1], T),
+                            strides=(s0 * self.hop, s1, s0))
+        windowed = self.plan.scratch('stft', frames.shape)
+        np.multiply(frames, self.window, out=windowed)
+        columns = rfft(windowed, axis=-1)
+        np.abs(columns, out=columns)
+        self.overlap.consume(count * self.hop)
+        return columns.transpose(1, 2, 0)
+
+# filters by name, as (kind, frequencies...) for filter_sos
+FILTER_PRESETS = {
+    'dc': ('highpass', 0.5),       # electrode drift
+    'mains50': ('notch', 50.0),    # power line hum
+    'mains60': ('notch', 60.0),
+    'eeg': ('bandpass', 0.5, 45.0),
+}
+
+def filter_sos(spec, rate, order=4):
+    """
+    Second-order sections of a filter given by preset name or as a
+    (kind, frequency[, frequency]) tuple in Hz. kind is 'notch',
+    'highpass', 'lowpass' or 'bandpass'; all but the notch are
+    Butterworth filters of the given order.
+    """
+    spec = FILTER_PRESETS.get(spec, spec)
+    kind, freqs = spec[0], spec[1:]
+    nyquist = rate / 2.0
+    if not 0 < min(freqs) <= max(freqs) < nyquist:
+        raise ValueError("%s filter at %s Hz is out of range at %g Hz"
+                         % (kind, '-'.join('%g' % f for f in freqs), rate))
+    w = [f / nyquist for f in freqs]
+    if kind == 'notch':
+        b, a = signal.iirnotch(w[0], 30.0)
+        return signal.tf2sos(b, a)
+    return signal.butter(order, w if kind == 'bandpass' else w[0],
+                         btype=kind, output='sos')
+
+def _sosfilt(sos, x, zi):
+    """
+    sosfilt along axis 0 that keeps non-finite samples (gaps in the feed,
+    see feeders.fill_gaps) out of the filter state: they are filtered as
+    zeros and passed on as NaN, and the state of a channel that ends the
+    block inside a gap starts over from zero. Returns (y, zi).
+    """
+    bad = ~np.isfinite(x)
+    if not bad.any():
+        return signal.sosfilt(sos, x, axis=0, zi=zi)
+    y, zi = signal.sosfilt(sos, np.where(bad, 0.0, x), axis=0, zi=zi)
+    y[bad] = np.nan
+    zi[..., bad[-1]] = 0.0
+    return y, zi
+
+def parse_filters(names):
+    " Filter specs from a comma separated list of presets, 'none' for none "
+    return () if names == 'none' else tuple(names.split(','))
+
+class StreamingFilter(object):
+    """
+    Cascade of IIR filters in second-order sections applied to every
+    channel of a (samples, channels) stream in one sosfilt call. The
+    filter state carries over between blocks. specs are FILTER_PRESETS
+    names or filter_sos tuples; without any the stage passes blocks on.
+    """
+
+    def __init__(self, channels, rate, specs=(), order=4):
+        sos = [filter_sos(spec, rate, order) for spec in specs]
+        self.sos = np.vstack(sos) if sos else np.zeros((0, 6))
+        self.zi = np.zeros((len(self.sos), 2, channels))
+
+    def process(self, x):
+        if len(x) == 0 or len(self.sos) == 0:
+            return x
+        y, self.zi = _sosfilt(self.sos, x, self.zi)
+        return y
+
+    def settle(self, tol=1e-6):
+        " Samples until the response to the initial state decays below tol "
+        if len(self.sos) == 0:
+            return 0
+        r = max(np.abs(np.roots(section[3:])).max() for section in self.sos)
+        return int(np.ceil(np.log(tol) / np.log(r))) if r > 0 else 0
+
+def band_weights(freqs, bands):
+    """
+    (bands, rows) matrix that sums the rows whose frequency lies in each
+    (name, low, high) band, e.g. with the packed frequencies of a plan.
+    Applied to squared magnitudes it gives the power in every band.
+    """
+    freqs = np.asarray(freqs)
+    return np.array([(freqs >= low) & (freqs < high)
+                     for _name, low, high in bands], dtype=np.float32)
+
+def _stage_factors(factor, max_stage):
+    " Split a decimation factor into stages of at most max_stage each "
+    primes = []
+    n, p = factor, 2
+    while n > 1:
+        while n % p == 0:
+            primes.append(p)
+            n //= p
+        p += 1
+    stages = []
+    for p in sorted(primes, reverse=True):
+        for i, q in enumerate(stages):
+            if q * p <= max_stage:
+                stages[i] = q * p
+                break
+        else:
+            stages.append(p)
+    return sorted(stages, reverse=True)
+
+class _FIRStage(object):
+    """
+    Low-pass FIR filter followed by downsampling, evaluated in polyphase
+    fashion: only the kept output samples are computed, as one matrix
+    product over a strided view of the input.
+    """
+
+    def __init__(self, q, channels, order=20):
+        self.q = q
+        taps = signal.firwin(order * q + 1, 1.0 / q, window='hamming')
+        self.taps = taps[::-1].copy()
+        self.hist = OverlapBuffer(len(taps) - 1, channels)
+        self.phase = 0 # index of the next kept sample in the next block
+
+    def process(self, x):
+        L = len(self.taps)
+        buf = self.hist.extend(x)
+        count = max(0, -(-(len(x) - self.phase) // self.q))
+        s0, s1 = buf.strides
+        frames = as_strided(buf[self.phase:], shape=(count, buf.shape[1], L),
+                            strides=(s0 * self.q, s1, s0))
+        y = frames.dot(self.taps)
+        self.phase += count * self.q - len(x)
+        self.hist.consume(len(x))
+        return y
+
+class _IIRStage(object):
+    " Chebyshev type I low-pass in second-order sections, then downsampling "
+
+    def __init__(self, q, channels, order=8):
+        self.q = q
+        self.sos = signal.cheby1(order, 0.05, 0.8 / q, output='sos')
+        self.zi = np.zeros((self.sos.shape[0], 2, channels))
+        self.phase = 0
+
+    def process(self, x):
+        if len(x) == 0:
+            return x
+        y, self.zi = _sosfilt(self.sos, x, self.zi)
+        out = y[self.phase::self.q]
+        self.phase += len(out) * self.q - len(x)
+        return out
+
+class Decimator(object):
+    """
+    Anti-aliased downsampling of a multichannel stream by `factor`. Large
+    factors are split into a cascade of stages of at most `max_stage`.
+    Filter state and the sample phase carry over between blocks, so the
+    output does not depend on how the input was split into blocks.
+    ftype is 'fir' (linear phase) or 'iir' (cheaper, like scipy's
+    decimate).
+    """
+
+    def __init__(self, factor, channels, ftype='fir', max_stage=8):
+        stage = {'fir': _FIRStage, 'iir': _IIRStage}[ftype]
+        self.factor = factor
+        self.stages = [stage(q, channels)
+                       for q in _stage_factors(factor, max_stage)]
+
+    def process(self, block):
+        for stage in self.stages:
+            block = stage.process(block)
+        return block
+
+class StreamingWaveletPacket(object):
+    """
+    Undecimated (stationary) wavelet packet transform of a multichannel
+    stream. Each level filters all nodes of the previous level with the
+    wavelet's decomposition filters, dilated by 2**level, keeping the
+    lfilter state of every node between calls, so new samples only cost
+    the coefficients they produce. The magnitudes of the finest level are
+    sampled every `stride` samples into (channels, 2**level, columns)
+    columns in frequency order, like pywt's get_level(order='freq').
+    """
+
+    def __init__(self, channels, wavelet='coif4', level=5, stride=16):
+        w = pywt.Wavelet(wavelet)
+        self.channels = channels
+        self.level = level
+        self.stride = stride
+        self.filters = []
+        for l in range(level):
+            lo = np.zeros((len(w.dec_lo) - 1) * 2 ** l + 1)
+            hi = np.zeros_like(lo)
+            lo[::2 ** l] = w.dec_lo
+            hi[::2 ** l] = w.dec_hi
+            self.filters.append((lo, hi))
+        self.reset()
+
+    def reset(self):
+        " Forget all filter state, as if the stream started now "
+        self.zi = [(np.zeros((len(lo) - 1, 2 ** l, self.channels)),
+                    np.zeros((len(hi) - 1, 2 ** l, self.channels)))
+                   for l, (lo, hi) in enumerate(self.filters)]
+        self.phase = 0
+
+    def process(self, block):
+        n = len(block)
+        x = np.asarray(block, dtype=np.float64).reshape(n, 1, self.channels)
+        for l, (lo, hi) in enumerate(self.filters):
+            if n == 0:
+                break
+            zlo, zhi = self.zi[l]
+            ylo, zlo = signal.lfilter(lo, [1.0], x, axis=0, zi=zlo)
+            yhi, zhi = signal.lfilter(hi, [1.0], x, axis=0, zi=zhi)
+            self.zi[l] = (zlo, zhi)
+            # high-pass branches mirror the spectrum, so children of odd
+            # nodes swap places to keep the nodes in frequency order
+            lo_first = (np.arange(x.shape[1]) % 2 == 0)[None, :, None]
+            x = np.empty((n, 2 * x.shape[1], self.channels))
+            x[:, 0::2] = np.where(lo_first, ylo, yhi)
+            x[:, 1::2] = np.where(lo_first, yhi, ylo)
+        columns = np.abs(x[self.phase::self.stride])
+        self.phase += len(columns) * self.stride - n
+        return columns.transpose(2, 1, 0)
+
+if __name__ == '__main__':
+    # a channel recovers from a gap of NaN samples in the feed
+    rate = 256.0
+    f = StreamingFilter(2, rate, ('dc', 'mains50'))
+    t = np.arange(4096) / rate
+    x = np.column_stack([np.sin(2 * np.pi * 10 * t)] * 2)
+    x[1000:1300, 1] = np.nan
+    y = np.concatenate([f.process(b) for b in np.array_split(x, 64)])
+    assert np.isnan(y[1000:1300, 1]).all()
+    assert np.isfinite(y[1300:, 1]).all() and np.isfinite(f.zi).all()
+    settled = 1300 + f.settle(1e-3)
+    assert np.allclose(y[settled:, 1], y[settled:, 0], atol=1e-2)
+    print('ok')
@@ -1,16 +1,122 @@
 import sys
 import os
+import errno
 import fcntl
+import mmap
+import time
+import select
+import socket
+import termios
+import threading
 import numpy as np
-from operator import itemgetter
-from struct import unpack
 import io
 
+from buffers import SampleRing
+
+# Feeders return blocks of shape (n_samples, n_channels) as float32
+
 def random_sinoids():
-    return np.sin(np.arange(100)*np.random.random(1)*5.0)
+    x = np.sin(np.arange(100)*np.random.random(1)*5.0)
+    return x.astype(np.float32).reshape(-1, 1)
 
 def random_positive_sinoids():
-    return np.sin(np.arange(100)*np.random.random(1)*5.0) / 2.0 + 0.5
+    x = np.sin(np.arange(100)*np.random.random(1)*5.0) / 2.0 + 0.5
+    return x.astype(np.float32).reshape(-1, 1)
+
+class SyntheticFeeder(object):
+    """
+    Deterministic EEG-like test signal for load testing. Every channel is
+    a sum of band-limited components (random tones within each band, with
+    per-channel phases and gains), white noise and occasional blink-like
+    artifacts. The signal depends only on the seed and the sample index.
+
+    Calls return the samples due since the previous call according to the
+    wall clock, or `block` samples per call in benchmark mode.
+    """
+    bands = [
+        # low, high (Hz), amplitude
+        (0.5, 4.0, 1.0),
+        (4.0, 8.0, 0.5),
+        (8.0, 14.0, 1.0),
+        (14.0, 30.0, 0.3),
+    ]
+    tones_per_band = 4
+
+    def __init__(self, channels=8, rate=256.0, seed=0, bands=None,
+                 noise=0.2, artifact_rate=0.2, mains=50.0, scale=0.1,
+                 benchmark=False, block=1024, max_block=None):
+        self.channels = channels
+        self.rate = rate
+        self.noise = noise
+        self.artifact_rate = artifact_rate
+        self.scale = scale
+        self.benchmark = benchmark
+        self.block = block
+        self.max_block = max_block or int(10 * rate)
+        self.rng = np.random.RandomState(seed)
+        self.noise_rng = np.random.RandomState(self.rng.randint(2**31))
+        self.artifact_rng = np.random.RandomState(self.rng.randint(2**31))
+        if bands is None:
+            bands = self.bands
+        if mains:
+            bands = list(bands) + [(mains, mains, 0.2)]
+
+        k = self.tones_per_band
+        lo = np.repeat([b[0] for b in bands], k)
+        hi = np.repeat([b[1] for b in bands], k)
+        amp = np.repeat([b[2] for b in bands], k) / np.sqrt(k)
+        shape = (len(lo), channels)
+        self.freqs = (lo[:, None] + (hi - lo)[:, None] *
+                      self.rng.random_sample(shape)) / rate
+        self.phases = 2 * np.pi * self.rng.random_sample(shape)
+        self.gains = amp[:, None] * (0.5 + self.rng.random_sample(shape))
+
+        # blink artifacts: a 200 ms bump, strongest on the first channels
+        width = max(int(0.2 * rate), 1)
+        self.bump = np.hanning(width)
+        self.artifact_gain = 3.0 * np.exp(-np.arange(channels) / 2.0)
+        self.carry = np.zeros((width, channels))
+        self.next_artifact = self._artifact_interval()
+
+        self.produced = 0
+        self.started = time.time()
+
+    def _artifact_interval(self):
+        if not self.artifact_rate:
+            return np.inf
+        return max(1, int(self.artifact_rng.exponential(
+            self.rate / self.artifact_rate)))
+
+    def generate(self, n):
+        " The next n samples, shape (n, channels) "
+        t = np.arange(self.produced, self.produced + n, dtype=np.float64)
+        phase = 2 * np.pi * t[:, None, None] * self.freqs + self.phases
+        x = np.einsum('nkc,kc->nc', np.sin(phase), self.gains)
+        x += self.noise * self.noise_rng.standard_normal((n, self.channels))
+
+        # artifacts may spill over into the next block
+        width = len(self.bump)
+        x2 = np.zeros((n + width, self.channels))
+        x2[:width] += self.carry
+        while self.next_artifact < self.produced + n:
+            start = int(self.next_artifact - self.produced)
+            x2[start:start + width] += np.outer(self.bump, self.artifact_gain)
+            self.next_artifact += self._artifact_interval()
+        x += x2[:n]
+        self.carry = x2[n:]
+
+        self.produced += n
+        return (x * self.scale).astype(np.float32)
+
+    def __call__(self):
+        if self.benchmark:
+            return self.generate(self.block)
+        due = int((time.time() - self.started) * self.rate) - self.produced
+        if due > self.max_block:
+            # we were stalled, skip ahead instead of catching up at once
+            self.started += (due - self.max_block) / self.rate
+            due = self.max_block
+        return self.generate(max(due, 0))
 
 def _set_non_blocking(output):
     fd = output.fileno()
@@ -22,39 +128,718 @@ def stdin():
     def stdin_read():
         x = []
         try:
-            x = map(ord, sys.stdin.read()[:100])
-        except IOError, e:
-            print e
+            x = [ord(c) for c in sys.stdin.read()[:100]]
+        except IOError as e:
+            print(e)
             pass
-        print x
-        return x
+        print(x)
+        return np.array(x, dtype=np.float32).reshape(-1, 1)
     return stdin_read
 
 MODEEG_PKTLEN = 17
 MODEEG_SYNC = (0xa5, 0x5a, 0x02)
+MODEEG_CHANNELS = 6
+MODEEG_PACKET = np.dtype([
+    ('sync', 'u1', (3,)),
+    ('counter', 'u1'),
+    ('channels', '>u2', (MODEEG_CHANNELS,)),
+    ('switches', 'u1'),
+])
 
-def mk_modeeg(f):
+def _modeeg_headers(buf):
+    " Boolean mask of all positions where a sync header starts "
+    hdr = np.zeros(len(buf), dtype=bool)
+    if len(buf) >= 3:
+        hdr[:-2] = (buf[:-2] == MODEEG_SYNC[0]) & \
+                   (buf[1:-1] == MODEEG_SYNC[1]) & \
+                   (buf[2:] == MODEEG_SYNC[2])
+    return hdr
+
+def find_modeeg_runs(buf):
     """
-    Return a feeder function that spits out raw ModEEG data from any
-    file-like object f.
+    Locate runs of back-to-back packets in the uint8 array buf. Returns a
+    list of (offset, count) pairs and the offset up to which buf has been
+    consumed; bytes after it may still become part of a packet.
+    """
+    hdr = _modeeg_headers(buf)
+    candidates = np.flatnonzero(hdr)
+    n = len(buf)
+
+    # Every iteration consumes one run of headers spaced exactly one packet
+    # apart, so the Python loop runs once per sync loss, not once per packet.
+    runs = []
+    pos = 0
+    tail = max(0, n - (MODEEG_PKTLEN - 1))
+    while True:
+        i = np.searchsorted(candidates, pos)
+        if i == len(candidates):
+            break
+        start = candidates[i]
+        lane = hdr[start::MODEEG_PKTLEN]
+        count = np.argmin(lane) if not lane.all() else len(lane)
+        complete = min(count, (n - start) // MODEEG_PKTLEN)
+        broken = start + count * MODEEG_PKTLEN + 3 <= n
+        last = start + (count - 1) * MODEEG_PKTLEN
+        end = last + MODEEG_PKTLEN
+        # is there a header inside the last packet? Near the end of buf
+        # the start of one is enough, its end may still arrive
+        if complete == count and (hdr[last + 1:end].any() or any(
+                tuple(buf[j:n]) == MODEEG_SYNC[:n - j]
+                for j in range(max(last + 1, n - 2), min(end, n)))):
+            # the last packet contains the header of another one, so it
+            # was cut short on the wire; drop it and rescan past its
+            # header (or wait for more bytes if it may still be followed
+            # by a header). A whole last packet followed by noise is kept,
+            # the noise counts as a sync loss.
+            complete -= 1
+        if complete > 0:
+            runs.append((int(start), int(complete)))
+        pos = start + complete * MODEEG_PKTLEN
+        if complete < count and not broken:
+            # a header without its full packet yet, keep for next call
+            tail = pos
+            break
+        if complete < count:
+            pos += 1
+        tail = max(pos, tail)
+    return runs, int(tail)
+
+def counter_gaps(counters, previous=None):
+    """
+    Number of packets missing before each packet, judged by the rolling
+    8-bit packet counter; -1 marks a duplicate of the previous packet.
+    """
+    c = counters.astype(np.int16)
+    prev = np.empty_like(c)
+    prev[1:] = c[:-1]
+    if len(c):
+        prev[0] = c[0] - 1 if previous is None else previous
+    return (c - prev) % 256 - 1
+
+def fill_gaps(samples, gaps, method='nan', previous=None):
+    """
+    Insert one row per lost packet so that the output stays sample
+    accurate; gaps[i] rows are missing before samples[i]. Missing rows are
+    NaN, or linearly interpolated from their neighbours (and from the
+    `previous` row at the start of a block) with method='interpolate'.
+    """
+    gaps = np.maximum(gaps, 0)
+    total = int(gaps.sum())
+    if total == 0:
+        return samples
+    pos = np.arange(len(samples)) + np.cumsum(gaps)
+    out = np.empty((len(samples) + total, samples.shape[1]), dtype=samples.dtype)
+    out.fill(np.nan)
+    out[pos] = samples
+    if method == 'interpolate':
+        if previous is None:
+            previous = samples[0]
+        xp = np.concatenate(([-1], pos))
+        fp = np.vstack((previous, samples))
+        missing = np.setdiff1d(np.arange(len(out)), pos)
+        right = np.searchsorted(xp, missing)
+        w = ((missing - xp[right - 1]) / (xp[right] - xp[right - 1]).astype(float))
+        w = w.astype(samples.dtype)[:, None]
+        out[missing] = fp[right - 1] * (1 - w) + fp[right] * w
+    return out
+
+class ModEEGDecoder(object):
+    """
+    Incremental decoder for ModEEG P2 packets. Feed it byte strings of any
+    length; it returns the complete packets found so far as an array of
+    MODEEG_PACKET records and keeps partial packets for the next call.
+
+    The decoder follows the packet counter to count lost and duplicated
+    packets and keeps ingest health counters, see stats(). samples()
+    optionally fills lost packets with NaN ('nan') or linear interpolation
+    ('interpolate') and drops duplicates.
+    """
+
+    def __init__(self, fill=None):
+        self.leftover = b''
+        self.fill = fill
+        self.counter = None # last packet counter seen
+        self.last = None    # last sample, for interpolating across blocks
+        self.in_sync = True
+        self.started = time.time()
+        self.bytes = 0
+        self.packets = 0
+        self.skipped = 0
+        self.sync_losses = 0
+        self.lost = 0
+        self.duplicates = 0
+        self.gap_lengths = {}
+        self.gaps = np.zeros(0, dtype=np.int16)
+
+    def _track_sync(self, runs, tail):
+        end = 0
+        for start, count in runs:
+            if start > end:
+                self.skipped += start - end
+                if self.in_sync:
+                    self.sync_losses += 1
+            self.in_sync = True
+            end = start + count * MODEEG_PKTLEN
+        if tail > end:
+            self.skipped += tail - end
+            if self.in_sync:
+                self.sync_losses += 1
+            self.in_sync = False
+
+    def _track_counter(self, packets):
+        self.gaps = counter_gaps(packets['counter'], self.counter)
+        if len(packets):
+            self.counter = packets['counter'][-1]
+        self.packets += len(packets)
+        self.duplicates += int(np.count_nonzero(self.gaps < 0))
+        lengths = self.gaps[self.gaps > 0]
+        self.lost += int(lengths.sum())
+        for length, count in zip(*np.unique(lengths, return_counts=True)):
+            self.gap_lengths[int(length)] = \
+                self.gap_lengths.get(int(length), 0) + int(count)
+
+    def decode(self, data):
+        self.bytes += len(data)
+        data = self.leftover + data
+        runs, tail = find_modeeg_runs(np.frombuffer(data, dtype=np.uint8))
+        self._track_sync(runs, tail)
+        self.leftover = data[tail:]
+        if not runs:
+            packets = np.zeros(0, dtype=MODEEG_PACKET)
+        else:
+            packets = np.concatenate([
+                np.frombuffer(data, dtype=MODEEG_PACKET, count=count, offset=start)
+                for start, count in runs])
+        self._track_counter(packets)
+        return packets
+
+    def samples(self, data):
+        " Decode data straight to float32 samples, filling gaps if asked to "
+        packets = self.decode(data)
+        x = modeeg_samples(packets)
+        if self.fill is not None and len(x):
+            keep = self.gaps >= 0
+            x = fill_gaps(x[keep], self.gaps[keep], self.fill, self.last)
+            self.last = x[-1] if len(x) else self.last
+        return x
+
+    def stats(self):
+        elapsed = max(time.time() - self.started, 1e-9)
+        return {
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'packets_per_s': self.packets / elapsed,
+            'bytes_per_s': self.bytes / elapsed,
+            'sync_losses': self.sync_losses,
+            'skipped_bytes': self.skipped,
+            'lost': self.lost,
+            'duplicates': self.duplicates,
+            'gap_lengths': dict(self.gap_lengths),
+        }
+
+def modeeg_samples(packets):
+    " Scale the 10-bit channel values of decoded packets to float32 samples "
+    x = packets['channels'].astype(np.float32)
+    x -= 512
+    x /= 1024.0
+    return x
+
+def mk_modeeg(f, blocking=False, fill=None):
+    """
+    Return a feeder function that spits out raw ModEEG data of all six
+    channels from any file-like object f. The function's `stats` attribute
+    reports the decoder's ingest health counters; `fill` is passed on to
+    ModEEGDecoder.
+
+    With blocking=True the feeder waits for data instead and returns None
+    at end of file; use it with ThreadedFeeder.
     """
-    _set_non_blocking(f)
     inbuf = io.open(f.fileno(), mode='rb', closefd=False)
+    decoder = ModEEGDecoder(fill)
+    if blocking:
+        def blocking_read():
+            data = inbuf.read1(65536)
+            if not data:
+                return None
+            return decoder.samples(data)
+        blocking_read.stats = decoder.stats
+        return blocking_read
+
+    _set_non_blocking(f)
     def stdin_read():
-        x = []
-        leftover = None
-        for i in range(256): # Limit to 256 frames per call FIXME
-            data = inbuf.read(MODEEG_PKTLEN)
-            if data is None or len(data) < MODEEG_PKTLEN:
-                leftover = data
-                break
-            info = unpack('>BBBBHHHHHHB', data)
-            if info[:3] != MODEEG_SYNC:
-                inbuf.read(1)
-                continue
-            x.append(info)
-        # TODO: BufferedReader what?! make use of leftover!
-        y = [(info[4] - 512) / 1024.0 for info in x[:300]]
-        return y
+        data = inbuf.read() # everything that is available right now
+        if not data:
+            return np.zeros((0, MODEEG_CHANNELS), dtype=np.float32)
+        return decoder.samples(data)
+    stdin_read.stats = decoder.stats
     return stdin_read
 
+MODEEG_RATE = 256.0
+
+class ModEEGReplay(object):
+    """
+    Feeder that replays a recorded ModEEG dump. The file is memory-mapped
+    and indexed once; blocks are then served straight from the mapping at
+    `speed` times real time, or `block` packets per call as fast as
+    possible if speed is None. Use seek() to jump to any point in time.
+    """
+    scan_size = 1 << 24
+
+    def __init__(self, path, speed=1.0, rate=MODEEG_RATE, block=4096):
+        self.speed = speed
+        self.rate = rate
+        self.block = block
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.raw = np.frombuffer(self.mm, dtype=np.uint8)
+        self.offsets = self._index()
+        self.seek(0.0)
+
+    def _index(self):
+        " Offsets of all packets in the file, scanned in bounded chunks "
+        offsets = []
+        pos = 0
+        n = len(self.raw)
+        while pos < n:
+            stop = min(pos + self.scan_size, n)
+            runs, tail = find_modeeg_runs(self.raw[pos:stop])
+            for start, count in runs:
+                offsets.append(pos + start +
+                               MODEEG_PKTLEN * np.arange(count, dtype=np.int64))
+            if stop == n:
+                break
+            pos += max(tail, 1)
+        if not offsets:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(offsets)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @property
+    def duration(self):
+        return len(self.offsets) / self.rate
+
+    @property
+    def finished(self):
+        return self.pos >= len(self.offsets)
+
+    def tell(self):
+        " Current position in seconds "
+        return self.pos / self.rate
+
+    def seek(self, seconds):
+        self.pos = int(np.clip(round(seconds * self.rate), 0, len(self.offsets)))
+        self.started = time.time()
+        self.start_pos = self.pos
+
+    def packets(self, start, stop):
+        """
+        Packets start..stop as MODEEG_PACKET records. Runs without sync
+        losses are returned as views into the mapping without copying.
+        """
+        offsets = self.offsets[start:stop]
+        if len(offsets) == 0:
+            return np.zeros(0, dtype=MODEEG_PACKET)
+        if offsets[-1] - offsets[0] == MODEEG_PKTLEN * (len(offsets) - 1):
+            return np.frombuffer(self.mm, dtype=MODEEG_PACKET,
+                                 count=len(offsets), offset=int(offsets[0]))
+        idx = offsets[:, None] + np.arange(MODEEG_PKTLEN)
+        return self.raw[idx].view(MODEEG_PACKET).ravel()
+
+    def __call__(self):
+        if self.speed is None:
+            stop = self.pos + self.block
+        else:
+            elapsed = time.time() - self.started
+            stop = self.start_pos + int(elapsed * self.rate * self.speed)
+        stop = min(stop, len(self.offsets))
+        packets = self.packets(self.pos, stop)
+        self.pos = max(self.pos, stop)
+        return modeeg_samples(packets)
+
+monotonic = getattr(time, 'monotonic', time.time)
+
+def configure_serial(fd, baud=57600):
+    """
+    Put the tty fd into raw 8N1 mode at the given baud rate, the same
+    settings utils/rec-modeeg applies with stty.
+    """
+    speed = getattr(termios, 'B%d' % baud)
+    iflag, oflag, cflag, lflag, ispeed, ospeed, cc = termios.tcgetattr(fd)
+    iflag = termios.IGNBRK
+    oflag = 0
+    lflag = 0
+    cflag &= ~(termios.CSIZE | termios.PARENB | termios.CSTOPB |
+               termios.CRTSCTS)
+    cflag |= termios.CS8 | termios.CREAD | termios.CLOCAL
+    cc[termios.VMIN] = 1
+    cc[termios.VTIME] = 0
+    termios.tcsetattr(fd, termios.TCSANOW,
+                      [iflag, oflag, cflag, lflag, speed, speed, cc])
+    termios.tcflush(fd, termios.TCIFLUSH)
+
+class SerialFeeder(object):
+    """
+    Blocking feeder that reads ModEEG packets straight from a serial
+    device, or from the slave end of a pseudo-terminal pair standing in
+    for the hardware. Every read is timestamped with a monotonic clock and
+    stats() reports how late samples arrive compared to the nominal rate.
+    Returns None once the device goes away; use it with ThreadedFeeder.
+    """
+
+    def __init__(self, path, baud=57600, fill=None, read_size=65536,
+                 rate=MODEEG_RATE):
+        self.fd = os.open(path, os.O_RDONLY | os.O_NOCTTY)
+        if os.isatty(self.fd):
+            configure_serial(self.fd, baud)
+        self.decoder = ModEEGDecoder(fill)
+        self.read_size = read_size
+        self.rate = rate
+        self.timestamp = None # time of the last read
+        self.first = None
+        self.reads = 0
+        self.lag = [0.0, 0.0, 0.0] # sum, sum of squares, max
+
+    def read_raw(self):
+        " Next chunk of raw bytes, b'' when the device is gone "
+        try:
+            data = os.read(self.fd, self.read_size)
+        except OSError:
+            data = b''
+        self.timestamp = monotonic()
+        if self.first is None:
+            self.first = self.timestamp
+        self.reads += 1
+        return data
+
+    def __call__(self):
+        data = self.read_raw()
+        if not data:
+            return None
+        block = self.decoder.samples(data)
+        # how far the newest sample lags behind a perfect clock started
+        # at the first read
+        lag = self.timestamp - self.first - self.decoder.packets / self.rate
+        self.lag[0] += lag
+        self.lag[1] += lag * lag
+        self.lag[2] = max(self.lag[2], lag)
+        return block
+
+    def stats(self):
+        stats = self.decoder.stats()
+        n = max(self.reads, 1)
+        mean = self.lag[0] / n
+        stats.update({
+            'reads': self.reads,
+            'lag_mean': mean,
+            'lag_jitter': max(self.lag[1] / n - mean * mean, 0.0) ** 0.5,
+            'lag_max': self.lag[2],
+        })
+        return stats
+
+    def close(self):
+        os.close(self.fd)
+
+class ThreadedFeeder(object):
+    """
+    Run a blocking feeder function on its own thread and collect its
+    blocks in a SampleRing. Calling the ThreadedFeeder drains the ring
+    without blocking, so it can be handed to TimeSeries like any other
+    feeder. The wrapped function returns None when its source is
+    exhausted.
+    """
+
+    def __init__(self, read_func, channels, capacity=65536,
+                 overflow='drop-oldest'):
+        self.read_func = read_func
+        self.ring = SampleRing(capacity, channels, overflow)
+        self.running = True
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            block = self.read_func()
+            if block is None:
+                break
+            if len(block):
+                self.ring.write(block)
+        self.running = False
+
+    def __call__(self):
+        return self.ring.read()
+
+    def stop(self):
+        self.running = False
+        self.ring.close()
+
+    def stats(self):
+        stats = {}
+        if hasattr(self.read_func, 'stats'):
+            stats.update(self.read_func.stats())
+        stats.update({
+            'samples': self.ring.head,
+            'overruns': self.ring.overruns,
+            'blocked': self.ring.blocked,
+            'running': self.running,
+        })
+        return stats
+
+READ_SIZE = 65536
+
+class TCPFeeder(object):
+    """
+    Blocking feeder that reads a ModEEG stream from a TCP connection, e.g.
+    a collector serving `rec-modeeg` with `nc -l`. Returns None once the
+    connection closes; use it with ThreadedFeeder.
+    """
+
+    def __init__(self, host, port, fill=None, read_size=READ_SIZE):
+        self.sock = socket.create_connection((host, port))
+        self.decoder = ModEEGDecoder(fill)
+        self.read_size = read_size
+
+    def __call__(self):
+        try:
+            data = self.sock.recv(self.read_size)
+        except socket.error:
+            data = b''
+        if not data:
+            return None
+        return self.decoder.samples(data)
+
+    def stats(self):
+        return self.decoder.stats()
+
+    def close(self):
+        self.sock.close()
+
+class Collector(object):
+    """
+    Decode state and sample ring of one collector slot. Calling it drains
+    the samples of whichever collector holds the slot.
+    """
+
+    def __init__(self, slot, fill=None, capacity=65536):
+        self.slot = slot
+        self.fill = fill
+        self.ring = SampleRing(capacity, MODEEG_CHANNELS, 'drop-oldest')
+        self.pending = np.zeros((0, MODEEG_CHANNELS), dtype=np.float32)
+        self.reset(None)
+
+    def reset(self, peer):
+        " Hand the slot to a new peer (or free it) with fresh decode state "
+        self.peer = peer
+        self.decoder = ModEEGDecoder(self.fill)
+        self.last_seen = time.time()
+
+    def feed(self, data):
+        self.last_seen = time.time()
+        block = self.decoder.samples(data)
+        if len(block):
+            self.ring.write(block)
+        return block
+
+    def __call__(self):
+        return self.ring.read()
+
+    def stats(self):
+        stats = self.decoder.stats()
+        stats.update({'peer': self.peer, 'overruns': self.ring.overruns})
+        return stats
+
+class CollectorSlots(object):
+    """
+    Several collectors streaming into one process, over TCP or as UDP
+    datagrams; each one gets a slot with its own decoder. Every slot can
+    be used as a separate feeder (stream(slot)), or the object itself is
+    a feeder that returns all slots side by side as groups of
+    MODEEG_CHANNELS channels. Callbacks registered with subscribe() get
+    every decoded block as it arrives.
+
+    Subclasses do the networking, see CollectorServer here and in
+    aiofeeders.
+    """
+    max_skew = 512 # samples a slot may lag before it is padded with NaN
+
+    def __init__(self, slots=4, fill=None, udp_timeout=10.0):
+        self.collectors = [Collector(i, fill) for i in range(slots)]
+        self.udp_timeout = udp_timeout
+        self.udp_peers = {}
+        self.rejected = 0
+        self.callbacks = []
+        self.thread = None
+
+    @property
+    def channels(self):
+        return MODEEG_CHANNELS * len(self.collectors)
+
+    def stream(self, slot):
+        return self.collectors[slot]
+
+    def subscribe(self, callback):
+        self.callbacks.append(callback)
+
+    def _acquire(self, peer):
+        for c in self.collectors:
+            if c.peer is None:
+                c.reset(peer)
+                return c
+        # reclaim the slot of a UDP collector that went quiet
+        now = time.time()
+        for addr, c in list(self.udp_peers.items()):
+            if now - c.last_seen > self.udp_timeout:
+                del self.udp_peers[addr]
+                c.reset(peer)
+                return c
+        self.rejected += 1
+        return None
+
+    def _feed(self, c, data):
+        block = c.feed(data)
+        if len(block):
+            for callback in self.callbacks:
+                callback(block)
+
+    def _datagram(self, data, addr):
+        c = self.udp_peers.get(addr)
+        if c is None:
+            c = self._acquire(('udp',) + tuple(addr))
+            if c is None:
+                return
+            self.udp_peers[addr] = c
+        self._feed(c, data)
+
+    def __call__(self):
+        """
+        Samples of all slots aligned side by side. Output follows the
+        slowest connected collector unless it lags by more than max_skew
+        samples; free slots and lagging collectors read as NaN.
+        """
+        lengths = []
+        for c in self.collectors:
+            c.pending = np.concatenate((c.pending, c()))[-c.ring.capacity:]
+            if c.peer is not None or len(c.pending):
+                lengths.append(len(c.pending))
+        if not lengths:
+            return np.zeros((0, self.channels), dtype=np.float32)
+        n = min(lengths)
+        if max(lengths) - n > self.max_skew:
+            n = max(lengths)
+        out = np.empty((n, self.channels), dtype=np.float32)
+        out.fill(np.nan)
+        for c in self.collectors:
+            k = min(n, len(c.pending))
+            out[:k, c.slot * MODEEG_CHANNELS:(c.slot + 1) * MODEEG_CHANNELS] = \
+                c.pending[:k]
+            c.pending = c.pending[k:]
+        return out
+
+    def stats(self):
+        return {
+            'rejected': self.rejected,
+            'collectors': [c.stats() for c in self.collectors],
+        }
+
+class _Poller(object):
+    " Sockets that are ready for reading, with epoll where there is one "
+
+    def __init__(self):
+        self.epoll = select.epoll() if hasattr(select, 'epoll') else None
+        self.fds = set()
+
+    def register(self, fd):
+        self.fds.add(fd)
+        if self.epoll is not None:
+            self.epoll.register(fd, select.EPOLLIN)
+
+    def unregister(self, fd):
+        self.fds.discard(fd)
+        if self.epoll is not None:
+            self.epoll.unregister(fd)
+
+    def poll(self, timeout):
+        if self.epoll is not None:
+            return [fd for fd, _event in self.epoll.poll(timeout)]
+        return select.select(list(self.fds), [], [], timeout)[0]
+
+class CollectorServer(CollectorSlots):
+    """
+    CollectorSlots served from a background thread that waits for TCP
+    connections and UDP datagrams on one port with epoll (or select).
+    Collectors only ever block that thread, so the viewer draws on.
+    """
+
+    def start(self, port, host=None, udp=True):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host or '', port))
+        self.listener.listen(8)
+        self.udp = None
+        if udp:
+            self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp.bind((host or '', port))
+        self.running = True
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def serve(self):
+        poller = _Poller()
+        poller.register(self.listener.fileno())
+        if self.udp is not None:
+            poller.register(self.udp.fileno())
+        connections = {} # fd: (socket, collector)
+        while self.running:
+            for fd in poller.poll(1.0):
+                if fd == self.listener.fileno():
+                    conn, peer = self.listener.accept()
+                    c = self._acquire(peer)
+                    if c is None:
+                        conn.close()
+                        continue
+                    conn.setblocking(0)
+                    connections[conn.fileno()] = (conn, c)
+                    poller.register(conn.fileno())
+                elif self.udp is not None and fd == self.udp.fileno():
+                    data, addr = self.udp.recvfrom(READ_SIZE)
+                    self._datagram(data, addr)
+                elif fd in connections:
+                    conn, c = connections[fd]
+                    try:
+                        data = conn.recv(READ_SIZE)
+                    except socket.error as e:
+                        if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                            continue
+                        data = b''
+                    if data:
+                        self._feed(c, data)
+                        continue
+                    poller.unregister(fd)
+                    del connections[fd]
+                    conn.close()
+                    c.reset(None)
+        for conn, c in connections.values():
+            conn.close()
+            c.reset(None)
+        self.listener.close()
+        if self.udp is not None:
+            self.udp.close()
+
+    def stop(self):
+        self.running = False
+
+def add_source_arguments(parser):
+    " The network and serial source options of dantien.py and aiofeeders.py "
+    parser.add_argument('--tcp', metavar='HOST:PORT',
+            help='read ModEEG data from a TCP connection')
+    parser.add_argument('--listen', type=int, metavar='PORT',
+            help='accept ModEEG data from collectors connecting on PORT')
+    parser.add_argument('--serial', metavar='DEVICE',
+            help='read ModEEG data from a serial device')
+    parser.add_argument('--collectors', type=int, default=0, metavar='N',
+            help='with --listen, accept up to N collectors at once (TCP '
+                 'or UDP), each as its own group of channels')
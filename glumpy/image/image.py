@@ -181,8 +181,16 @@ class Image(object):
 
 
         
-    def update(self):
-        ''' Data update. '''
+    def update(self, Z=None):
+        ''' Data update.
+
+        ``Z``: numpy array or None
+            New data with the shape and type of the current data, uploaded
+            into the existing texture. Set vmin and vmax to avoid scanning
+            it for its range; values outside are clamped by the GPU.
+        '''
+        if Z is not None:
+            self.Z = self._data = Z
         if self._vmin is None:
             vmin = self._data.min()
         else:
@@ -198,13 +206,22 @@ class Image(object):
         if colormap:
             s = colormap.size
             self._texture.update(bias = 1.0/(s-1)-vmin*((s-3.1)/(s-1))/(vmax-vmin),
-                                 scale = ((s-3.1)/(s-1))/(vmax-vmin))
+                                 scale = ((s-3.1)/(s-1))/(vmax-vmin), Z=Z)
         else:
-            self._texture.update(bias=-vmin/(vmax-vmin),scale=1.0/(vmax-vmin))
+            self._texture.update(bias=-vmin/(vmax-vmin),scale=1.0/(vmax-vmin), Z=Z)
+
 
+    def draw(self, x, y, z, width, height, offset=(0.0, 0.0),
+             flip=(False, False)):
+        ''' Blit array onto active framebuffer.
 
-    def draw(self, x, y, z, width, height):
-        ''' Blit array onto active framebuffer. '''
+        ``offset``: tuple of 2 floats
+            Texture coordinate offset; the texture wraps around, so this
+            scrolls circular buffers (e.g. offset = cursor/width) into place.
+
+        ``flip``: tuple of 2 bools
+            Mirror the image horizontally and/or vertically.
+        '''
 
         self._filter.activate( self._texture )
         #if self.origin == 'lower':
@@ -220,17 +237,34 @@ class Image(object):
         mx, my = np.mgrid[0:n,0:n]/float(n-1)
         self._vertices['position']['x'] = x + width * mx
         self._vertices['position']['y'] = y + height*(1-my)
+        self._vertices['tex_coord']['u'] = (1-mx if flip[0] else mx) + offset[0]
+        self._vertices['tex_coord']['v'] = (1-my if flip[1] else my) + offset[1]
+        wrap = gl.GL_REPEAT if any(offset) else gl.GL_CLAMP
+        gl.glTexParameterf( self._texture.target, gl.GL_TEXTURE_WRAP_S, wrap )
+        gl.glTexParameterf( self._texture.target, gl.GL_TEXTURE_WRAP_T, wrap )
 
         from math import floor
         
         #print self._vertices['position']['z'].shape , 
         stretchx = lambda x: int(floor(x / float(n) * self.Z.shape[0]))
         stretchy = lambda y: int(floor(y / float(n) * self.Z.shape[1]))
+        if flip[1]:
+            stretchx = lambda x: self.Z.shape[0] - 1 - int(floor(x / float(n) * self.Z.shape[0]))
+        if flip[0]:
+            stretchy = lambda y: self.Z.shape[1] - 1 - int(floor(y / float(n) * self.Z.shape[1]))
+        # heights scroll with the texture coordinates
+        shiftx = int(offset[1] * self.Z.shape[0])
+        shifty = int(offset[0] * self.Z.shape[1])
+        rows, cols = stretchx, stretchy
+        stretchx = lambda x: (rows(x) + shiftx) % self.Z.shape[0]
+        stretchy = lambda y: (cols(y) + shifty) % self.Z.shape[1]
+        lo = -np.inf if self._vmin is None else self._vmin
+        hi = np.inf if self._vmax is None else self._vmax
 
         if 1:#self._vertices['position']['z'].shape == self.Z.shape:
             for xp in range(0,n):
                 for yp in range(0,n):
-                    self._vertices['position']['z'][xp][yp] = self.Z[stretchx(xp)][stretchy(yp)] * 0.2
+                    self._vertices['position']['z'][xp][yp] = min(max(self.Z[stretchx(xp)][stretchy(yp)], lo), hi) * 0.2
             self._vertices['position']['z'] = np.transpose(self._vertices['position']['z'])
 #, self._vertices['position']['z'].shape) * 0.8 # + np.sin((my * 20.0)) / 20.0 + np.cos((mx * 6.0)+0.2) / 20.0
 
@@ -262,9 +262,19 @@ class Texture(object):
         self.update()
 
 
-    def update(self, bias=0.0, scale=1.0):
-        ''' Update texture. '''
+    def update(self, bias=0.0, scale=1.0, Z=None):
+        ''' Update texture.
 
+        Z, if given, replaces the uploaded array; it must have the shape
+        and type the texture was built with. It is uploaded as is, without
+        an intermediate copy.
+        '''
+
+        if Z is not None:
+            if Z.shape != self._Z.shape or Z.dtype != self._Z.dtype:
+                raise TextureException(
+                    'Array shape or type does not match the texture.')
+            self._Z = Z
         gl.glBindTexture(self.target, self.id)
 
         # Autoscale array using OpenGL pixel transfer parameters
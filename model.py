@@ -3,65 +3,339 @@
 This is the data model for the EEG data. It stores the time series and calculates
 the spectrogram and other things.
 """
+import sys
+import threading
+import traceback
 import numpy as np
-import pywt
-from pytfd import stft
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from buffers import MirroredRing, DoubleBuffer, HistoryPyramid
+from dsp import StreamingSTFT, StreamingWaveletPacket, Decimator, \
+        StreamingFilter, band_weights
+from pytfd.plans import get_plan
+from pipeline import Pipeline, Source, Wrap, Reducer, Sink
 
 from datetime import datetime
 
+# EEG frequency bands (name, low, high) in Hz
+BRAINWAVES = [
+    ('delta', 0.5, 4.0),
+    ('theta', 4.0, 8.0),
+    ('alpha', 8.0, 14.0),
+    ('beta', 14.0, 30.0),
+]
+
+class ComputeWorker(object):
+    """
+    Runs submitted calls one after another on a background thread, so
+    that analysis does not hold up the thread that draws.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, func, *args):
+        self.queue.put((func, args))
+
+    def backlog(self):
+        return self.queue.qsize()
+
+    def _run(self):
+        while True:
+            func, args = self.queue.get()
+            try:
+                func(*args)
+            except Exception:
+                traceback.print_exc(file=sys.stderr)
+
 class TimeSeries():
     window_size = 128
     buffer_len = 512
     frame_rate = 256.0
-    zoom = 16
+    zoom = 16 # decimation factor from the feed to the analysis rate
+    hop = 1 # samples between spectrogram columns
+    # filters applied to the feed before decimation, see dsp.FILTER_PRESETS
+    filters = ('dc', 'mains50')
+    window_name = 'rectangular' # STFT window, see pytfd.windows
+    # display ranges, the views clip to these when drawing
+    spectrogram_range = (0.0, 2.0)
+    scaleogram_range = (0.0, 0.3)
+    # bands tracked by band_power. They get their own decimator and STFT
+    # at about band_rate (never below the spectrogram's rate), since the
+    # spectrogram's rate is too low for alpha and beta; bands above the
+    # Nyquist frequency of that rate are rejected
+    bands = BRAINWAVES
+    band_rate = 128.0
+    band_len = 512 # band power columns kept
+    # long spectrogram history, see history(). It costs an STFT on every
+    # update, so it is only kept from the first history() call on, or
+    # from the start with keep_history
+    keep_history = False
+    history_bytes = 16 << 20 # memory for all channels and levels
+    history_levels = 6 # each level pools history_factor columns of the last
+    history_factor = 4
+
+    # stages eat() runs, the products are computed from their output
+    ingest = ('series', 'band_series')
 
-    def __init__(self, feed_func):
-        # Actual time series buffer
-        self.series = np.zeros(self.buffer_len)
-        # Spectrogram data (STFT)
-        self.dat_s = np.zeros((self.window_size, self.buffer_len))
-        # Scaleogram data (Wavelet transform)
-        self.dat_w = np.zeros((32, 32)) # TODO
+    def __init__(self, feed_func, channels=1, dtype=np.float32, threaded=False,
+                 filters=None, rate=None):
+        self.channels = channels
+        if filters is not None:
+            self.filters = tuple(filters)
+        if rate is not None:
+            # sample rate of the feed, the analysis runs at rate / zoom
+            self.frame_rate = float(rate)
+        # Actual time series buffer, one column per channel
+        self.ring = MirroredRing(self.buffer_len, channels, dtype)
+        # Spectrogram data (STFT), see dat_s. Products are kept unclipped
+        # in float32, low frequencies first, so they upload as textures as is
+        self._spectrogram = DoubleBuffer(channels, self.window_size,
+                self.buffer_len, np.float32)
+        # Scaleogram data (Wavelet transform), see dat_w
+        self._scaleogram = DoubleBuffer(channels, 32, 32, np.float32)
+        # Band powers, one column per spectrogram column, see dat_b
+        self._band_power = DoubleBuffer(channels, len(self.bands),
+                self.band_len, np.float32)
+        self.spectrogram_history = HistoryPyramid.with_budget(
+                self.history_bytes, channels, self.window_size,
+                self.history_levels, self.history_factor)
 
         self.feed_func = feed_func
-        self.window = np.ones(self.window_size)
+        # window and frequency axis are shared with everyone using the plan
+        self.plan = get_plan('rfft', self.window_size, self.window_name,
+                             np.float32, self.frame_rate / self.zoom)
+        self.window = self.plan.window
+        self.freqs = self.plan.freqs
+        # band columns line up with spectrogram columns: both come every
+        # zoom * hop samples of the feed
+        step = self.zoom * self.hop
+        limit = max(self.frame_rate / self.band_rate, 1)
+        self.band_zoom = max(d for d in range(1, self.zoom + 1)
+                             if step % d == 0 and d <= limit)
+        self.band_hop = step // self.band_zoom
+        self.band_plan = get_plan('rfft', self.window_size, self.window_name,
+                np.float32, self.frame_rate / self.band_zoom)
+        nyquist = self.frame_rate / self.band_zoom / 2
+        for name, low, high in self.bands:
+            if high > nyquist:
+                raise ValueError("%s band (%g-%g Hz) is above the Nyquist "
+                                 "frequency of the band analysis, %g Hz"
+                                 % (name, low, high, nyquist))
+        self.band_weights = band_weights(self.band_plan.packed_freqs,
+                                         self.bands)
+        # the feed at the band analysis rate, as long as the series
+        self.band_ring = MirroredRing(self.buffer_len * self.zoom //
+                                      self.band_zoom, channels, dtype)
+        self.pipeline = Pipeline()
+        self.build(self.pipeline)
+        if self.keep_history:
+            # kept from the start of the stream, there is nothing to prime
+            history = self.pipeline['history']
+            history.subscribers += 1
+            history.live = True
         self.update_time = datetime.now()
+        # analysis runs on a worker thread if threaded, else lazily when
+        # a product is read after new samples arrived
+        self.worker = ComputeWorker() if threaded else None
+        self.pending = []
+
+    def build(self, p):
+        """
+        Set up the stages of the pipeline. Everything up to the ingest
+        stages ('series' and 'band_series') runs in eat(), the stages
+        downstream of them are products that are only computed while
+        subscribed. Subclasses (or deployments, through
+        ts.pipeline) add, remove or replace stages here.
+        """
+        C = self.channels
+        p.add(Source('source', self.feed_func))
+        p.add(Wrap('filter', lambda: StreamingFilter(C, self.frame_rate,
+                self.filters), ['source'], 'filter'))
+        p.add(Wrap('decimator', lambda: Decimator(self.zoom, C),
+                ['filter'], 'decimator'))
+        p.add(Sink('series', self.ring.write, ['decimator'],
+                keep=self.buffer_len))
+        p.add(Wrap('stft', lambda: StreamingSTFT(self.plan, C, self.hop),
+                ['series']))
+        p.add(Sink('spectrogram', self._spectrogram.push, ['stft'],
+                self._spectrogram.publish))
+        p.add(Wrap('band_decimator', lambda: Decimator(self.band_zoom, C),
+                ['filter'], 'decimator'))
+        p.add(Sink('band_series', self.band_ring.write, ['band_decimator'],
+                keep=len(self.band_ring)))
+        p.add(Wrap('band_stft', lambda: StreamingSTFT(self.band_plan, C,
+                self.band_hop), ['band_series']))
+        p.add(Reducer('band_power', self.band_weights, ['band_stft'],
+                np.square))
+        p.add(Sink('bands', self._band_power.push, ['band_power'],
+                self._band_power.publish))
+        p.add(Sink('history', self.spectrogram_history.push, ['stft']))
+        p.add(Wrap('wavelet', lambda: StreamingWaveletPacket(C, 'coif4',
+                level=5, stride=self.buffer_len // 32), ['series']))
+        p.add(Sink('scaleogram', self._scaleogram.push, ['wavelet'],
+                self._scaleogram.publish))
 
-        self.freqs = np.fft.fftfreq(self.window_size) * self.frame_rate / self.zoom
+    # the streaming processors of the standard stages
+    filter = property(lambda self: self.pipeline['filter'].stage)
+    decimator = property(lambda self: self.pipeline['decimator'].stage)
+    band_decimator = property(
+            lambda self: self.pipeline['band_decimator'].stage)
+    stft = property(lambda self: self.pipeline['stft'].stage)
+    wavelet = property(lambda self: self.pipeline['wavelet'].stage)
+
+    def reset(self):
+        " Forget the state of the streaming stages, as if the stream started now "
+        self.pipeline.reset()
 
     def eat(self):
-        newdata = self.feed_func()
+        out = self.pipeline.run(self.ingest)
+        new = dict((name, out[name]) for name in self.ingest)
+        if self.worker is not None:
+            self.worker.submit(self.update, new)
+            return
+        self.pending.append(new)
+        # nobody may read for a while, but streaming stages must not miss
+        # samples, so do not let them pile up beyond the ring
+        if sum(len(p['series']) for p in self.pending) >= self.buffer_len:
+            self.catch_up()
+
+    def preprocess(self, block):
+        """
+        Filter a block of the feed and decimate it for the spectrogram
+        ('series') and the band powers ('band_series'), see analyze()
+        """
+        out = self.pipeline.run(['decimator', 'band_decimator'],
+                                {'source': block})
+        return {'series': out['decimator'],
+                'band_series': out['band_decimator']}
+
+    def catch_up(self):
+        " Fold samples that arrived since the last read into the products "
+        if self.pending:
+            new = dict((name, np.concatenate([p[name] for p in self.pending]))
+                       for name in self.ingest)
+            self.pending = []
+            self.update(new)
 
-        # take every n-th
-        zoomed = newdata[::self.zoom]
-        self.series = np.append(self.series[len(zoomed):], zoomed)
+    def _compute(self, func, *args):
+        if self.worker is None:
+            self.catch_up()
+            func(*args)
+        else:
+            self.worker.submit(func, *args)
 
-        assert len(self.series) == self.buffer_len
-        self.update(len(zoomed))
+    @property
+    def series(self):
+        " The last buffer_len samples, a view into the ring buffer "
+        return self.ring.view()
 
-    def update(self, n):
+    @property
+    def spectrogram(self):
+        " The last complete spectrogram ColumnRing "
+        self.catch_up()
+        return self._spectrogram.front
+
+    @property
+    def scaleogram(self):
+        " The last complete scaleogram ColumnRing "
+        self.catch_up()
+        return self._scaleogram.front
+
+    @property
+    def band_power(self):
+        " The last complete band power ColumnRing, (channels, bands, band_len) "
+        self.catch_up()
+        return self._band_power.front
+
+    @property
+    def dat_s(self):
+        " Chronologically ordered copy of the spectrogram columns "
+        return self.spectrogram.ordered()
+
+    @property
+    def dat_w(self):
+        " Chronologically ordered copy of the scaleogram columns "
+        return self.scaleogram.ordered()
+
+    @property
+    def dat_b(self):
+        " Chronologically ordered copy of the band power columns "
+        return self.band_power.ordered()
+
+    def history(self, seconds, width=None):
+        """
+        Spectrogram of the last `seconds` at no more than about `width`
+        columns, and the number of STFT frames each column pools. The
+        first call subscribes to the 'history' product (unless
+        keep_history is set), which starts it with the buffered series;
+        only what arrives while it is subscribed is kept.
+        """
+        if not self.pipeline['history'].subscribers:
+            self.subscribe('history')
+        self.catch_up()
+        rate = self.frame_rate / self.zoom / self.hop
+        stop = len(self.spectrogram_history)
+        return self.spectrogram_history.query(stop - int(seconds * rate),
+                                              stop, width)
+
+    def subscribe(self, product):
+        """
+        Declare that a consumer reads product, the name of a pipeline
+        stage ('series', 'spectrogram', 'bands', 'history', 'scaleogram').
+        Stages downstream of 'series' are only computed while they have
+        subscribers; the first subscriber primes the stage and what it
+        needs with the buffered series.
+        """
+        stage = self.pipeline[product]
+        stage.subscribers += 1
+        if stage.subscribers == 1:
+            history = {'series': self.series.copy(),
+                       'band_series': self.band_ring.view().copy()}
+            self._compute(self._prime, product, history)
+
+    def unsubscribe(self, product):
+        stage = self.pipeline[product]
+        stage.subscribers -= 1
+        if stage.subscribers == 0:
+            stage.live = False
+
+    def _prime(self, product, history):
+        " Bring product and what it needs up to date with history "
+        stage = self.pipeline[product]
+        if not stage.subscribers:
+            return
+        self.pipeline.run([product], history, 'prime')
+        stage.live = True
+
+    def update(self, new):
+        """
+        Update the subscribed products with the new samples of the ingest
+        stages (a dict by stage name) and publish them
+        """
+        live = [s.name for s in self.pipeline.stages.values()
+                if s.live and s.subscribers]
+        self.pipeline.run(live, new)
         self.update_time = datetime.now()
-        self.dat_s = np.roll(self.dat_s, -n)
-        self.update_w(n)
-        self.update_s(n)
-
-    def update_w(self, n):
-        " Update wavelet transform data "
-        level = 5
-        wp = pywt.WaveletPacket(self.series, 'coif4', 'sym', maxlevel=level)
-        nodes = wp.get_level(level, order='freq')
-        values = np.abs(np.array([nx.data for nx in nodes]))
-        self.dat_w = np.clip(values, 0.0, 0.3)
-        self.dat_w = np.flipud(self.dat_w) # TODO: do this during the visualisation
-
-    def update_s(self, n):
-        " Update STFT spectrogram data "
-        l = n + self.window_size * 3
-        c = n + self.window_size * 2
-        newpart = stft.spectogram(self.series[-l:], self.window)
-        newpart = np.clip(newpart, 0.0, 2.0)
-        newpart = np.flipud(newpart) # TODO: do this during the visualisation
-        self.dat_s[:,-c:] = newpart[:,-c:]
+
+    def analyze(self, new):
+        """
+        Spectrogram and band power columns of the frames the new samples
+        (as returned by preprocess()) complete, without storing them
+        """
+        out = self.pipeline.run(['stft', 'band_power'], new, publish=False)
+        return out['stft'], out['band_power']
+
+    def timings(self):
+        " Time spent in every pipeline stage so far, as a table "
+        return self.pipeline.report()
 
     def samples_since_last_update(self):
         return (datetime.now() - self.update_time).microseconds / 100.0
@@ -69,6 +343,7 @@ class TimeSeries():
 if __name__ == '__main__':
     from feeders import random_sinoids
     s = TimeSeries(random_sinoids)
+    s.subscribe('spectrogram')
     for _i in range(5): s.eat()
-    print s.dat_s
+    print(s.dat_s)
 
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+A small dataflow framework for the analysis. A Pipeline is a graph of
+named stages, each computing its output from the outputs of the stages it
+names as inputs. Stages are typed by what they do (source, filter,
+decimator, transform, reducer, sink) and time themselves, so the same
+graph runs in the viewer or headless, deployments add or remove stages
+without touching the rest, and timings() shows which stage eats the
+frame budget.
+"""
+import time
+import numpy as np
+from collections import OrderedDict
+
+clock = getattr(time, 'perf_counter', time.time)
+
+class Stage(object):
+    """
+    Base class of all stages. process(*blocks) gets the outputs of the
+    `inputs` stages and returns this stage's output. prime(*blocks) starts
+    the stage over on a block of history when a consumer comes alive,
+    publish() makes the results of a run visible to readers.
+
+    Stages that are subscribed to (or needed by a subscribed stage) are
+    computed, others are skipped; see Pipeline.
+    """
+    kind = None
+
+    def __init__(self, name, inputs=()):
+        self.name = name
+        self.inputs = tuple(inputs)
+        self.subscribers = 0
+        self.live = False # primed and kept up to date since
+        self.calls = 0
+        self.seconds = 0.0
+        self._outputs = [np.zeros(0, dtype=np.float32)] * 2
+        self._next = 0
+
+    def process(self, *blocks):
+        raise NotImplementedError
+
+    def prime(self, *blocks):
+        self.reset()
+        return self.process(*blocks)
+
+    def reset(self):
+        " Forget the stream state, as if the stream started now "
+
+    def publish(self):
+        pass
+
+    def output(self, shape, dtype=np.float32):
+        """
+        Preallocated output array of the given shape. Two buffers take
+        turns, so an output stays valid during the next run as well, long
+        enough for a DoubleBuffer to replay it. They only grow.
+
+        Reducer computes into these. The dsp processors behind Wrap keep
+        their overlap in preallocated buffers.OverlapBuffers, but what
+        scipy's filters and FFTs return is still a new array every run.
+        """
+        size = int(np.prod(shape))
+        buf = self._outputs[self._next]
+        if buf.size < size or buf.dtype != np.dtype(dtype):
+            buf = self._outputs[self._next] = np.empty(size, dtype)
+        self._next = 1 - self._next
+        return buf[:size].reshape(shape)
+
+class Source(Stage):
+    " Reads blocks from a feed function "
+    kind = 'source'
+
+    def __init__(self, name, read):
+        Stage.__init__(self, name)
+        self.read = read
+
+    def process(self):
+        return self.read()
+
+class Wrap(Stage):
+    """
+    Stage around a streaming processor from dsp (anything with a process
+    method). make() builds the processor and is called again on reset().
+    """
+    kind = 'transform'
+
+    def __init__(self, name, make, inputs, kind=None):
+        Stage.__init__(self, name, inputs)
+        if kind is not None:
+            self.kind = kind
+        self.make = make
+        self.reset()
+
+    def reset(self):
+        self.stage = self.make()
+
+    def process(self, block):
+        return self.stage.process(block)
+
+class Reducer(Stage):
+    """
+    Linear reduction of the rows of (..., rows, columns) blocks with a
+    (outputs, rows) weight matrix, after applying `pre` elementwise
+    (e.g. np.square to reduce power instead of magnitude).
+    """
+    kind = 'reducer'
+
+    def __init__(self, name, weights, inputs, pre=None):
+        Stage.__init__(self, name, inputs)
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.pre = pre
+        self.scratch = np.zeros(0, dtype=np.float32)
+
+    def process(self, block):
+        if self.pre is not None:
+            if self.scratch.size < block.size:
+                self.scratch = np.empty(block.size, dtype=np.float32)
+            x = self.scratch[:block.size].reshape(block.shape)
+            block = self.pre(block, out=x)
+        out = self.output(block.shape[:-2] +
+                          (len(self.weights), block.shape[-1]))
+        return np.matmul(self.weights, block, out=out)
+
+    def prime(self, block):
+        return self.process(block)
+
+class Sink(Stage):
+    """
+    Stores blocks with write(block), e.g. a buffer's push, and passes the
+    block on. publish, if given, is called after every run. If `keep` is
+    set only the newest keep samples are stored and passed on.
+    """
+    kind = 'sink'
+
+    def __init__(self, name, write, inputs, publish=None, keep=None):
+        Stage.__init__(self, name, inputs)
+        self.write = write
+        self._publish = publish
+        self.keep = keep
+
+    def process(self, block):
+        if self.keep is not None:
+            block = block[-self.keep:]
+        self.write(block)
+        return block
+
+    def prime(self, block):
+        return self.process(block)
+
+    def publish(self):
+        if self._publish is not None:
+            self._publish()
+
+class Pipeline(object):
+    """
+    Stages in dependency order; a stage may only use stages added before
+    it as inputs. run() computes a set of target stages from given
+    outputs of others, running each needed stage once.
+    """
+
+    def __init__(self):
+        self.stages = OrderedDict()
+
+    def add(self, stage):
+        for name in stage.inputs:
+            if name not in self.stages:
+                raise ValueError("stage %s needs unknown stage %s"
+                                 % (stage.name, name))
+        self.stages[stage.name] = stage
+        return stage
+
+    def remove(self, name):
+        users = [s.name for s in self.stages.values() if name in s.inputs]
+        if users:
+            raise ValueError("stage %s is used by %s"
+                             % (name, ', '.join(users)))
+        return self.stages.pop(name)
+
+    def __getitem__(self, name):
+        return self.stages[name]
+
+    def __contains__(self, name):
+        return name in self.stages
+
+    def closure(self, names, given=()):
+        " Stages needed to compute names from the given ones, in order "
+        needed = set(names)
+        for name in reversed(self.stages):
+            if name in needed and name not in given:
+                needed.update(self.stages[name].inputs)
+        return [name for name in self.stages
+                if name in needed and name not in given]
+
+    def run(self, targets, given=None, method='process', publish=True):
+        """
+        Run the stages needed for targets; given maps stage names to
+        outputs that are used instead of running those stages. method is
+        'process' or 'prime'. Returns the outputs of all stages run.
+        """
+        outputs = dict(given or {})
+        order = self.closure(targets, outputs)
+        for name in order:
+            stage = self.stages[name]
+            start = clock()
+            outputs[name] = getattr(stage, method)(
+                    *[outputs[i] for i in stage.inputs])
+            stage.seconds += clock() - start
+            stage.calls += 1
+        if publish:
+            for name in order:
+                self.stages[name].publish()
+        return outputs
+
+    def reset(self):
+        for stage in self.stages.values():
+            stage.reset()
+
+    def timings(self):
+        " (name, kind, calls, seconds) of every stage "
+        return [(s.name, s.kind, s.calls, s.seconds)
+                for s in self.stages.values()]
+
+    def report(self):
+        " Timings as a table, slowest stage first "
+        lines = []
+        for name, kind, calls, seconds in sorted(self.timings(),
+                                                 key=lambda t: -t[3]):
+            lines.append('%-12s %-10s %8d calls %10.3f s %8.3f ms/call' %
+                         (name, kind, calls, seconds,
+                          1e3 * seconds / calls if calls else 0.0))
+        return '\n'.join(lines)
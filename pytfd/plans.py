@@ -0,0 +1,81 @@
+"""This file defines a registry of transform plans: the windows,
+zero-padded kernels, frequency axes and scratch buffers a transform of a
+given size needs, computed once and shared by everyone using the same
+configuration.
+"""
+from __future__ import division
+
+import threading
+
+import numpy
+
+from pytfd import helpers as h
+from pytfd import windows
+
+_plans = {}
+_lock = threading.Lock()
+
+def _frozen(a):
+    a.setflags(write=False)
+    return a
+
+class Plan(object):
+    """Precomputed data for one (transform, size, window, dtype, rate).
+    Arrays are read-only since they are shared; scratch() hands out
+    per-thread buffers that are reused from call to call.
+    """
+
+    def __init__(self, transform, size, window, dtype, rate):
+        self.transform = transform
+        self.size = size
+        self.dtype = numpy.dtype(dtype)
+        self.rate = rate
+        # window is the name of a pytfd.windows function, or an array for
+        # a private plan that is not in the registry
+        if isinstance(window, str):
+            self.window_name = window
+            window = getattr(windows, window)(size)
+        else:
+            self.window_name = None
+        self.window = _frozen(numpy.array(window, dtype=self.dtype))
+        # frequency of every FFT bin, and of every row of the packed real
+        # FFT layout scipy.fftpack.rfft returns
+        self.freqs = _frozen(numpy.fft.fftfreq(size, 1 / rate))
+        self.packed_freqs = _frozen(
+            (numpy.arange(size) + 1) // 2 * (rate / size))
+        self._padded = {}
+        self._local = threading.local()
+
+    def padded(self, N):
+        """The window zero-padded to length N, centered"""
+        w = self._padded.get(N)
+        if w is None:
+            w = self._padded[N] = _frozen(h.zeropad(self.window, N))
+        return w
+
+    def scratch(self, name, shape, dtype=None):
+        """A reusable buffer of the given shape for the calling thread.
+        Its contents are undefined; it stays valid until the next call
+        with the same name.
+        """
+        dtype = numpy.dtype(dtype or self.dtype)
+        buffers = self._local.__dict__.setdefault('buffers', {})
+        size = int(numpy.prod(shape))
+        buf = buffers.get((name, dtype.str))
+        if buf is None or len(buf) < size:
+            buf = buffers[(name, dtype.str)] = numpy.empty(max(size, 1), dtype)
+        return buf[:size].reshape(shape)
+
+def get_plan(transform='rfft', size=128, window='rectangular',
+             dtype=numpy.float64, rate=1.0):
+    """The shared Plan for this configuration, created on first use"""
+    key = (transform, size, window, numpy.dtype(dtype).str, float(rate))
+    plan = _plans.get(key)
+    if plan is None:
+        with _lock:
+            plan = _plans.get(key)
+            if plan is None:
+                plan = _plans[key] = Plan(transform, size, window, dtype, rate)
+    return plan
+
+__all__ = ['Plan', 'get_plan']
@@ -3,11 +3,14 @@ from __future__ import division
 from numpy import *
 from numpy.fft import fft
 from pytfd import helpers as h
-
+from pytfd.plans import Plan
 
 def pwd(x, w):
     N = len(x)
-    w = h.zeropad(w, N)
+    if isinstance(w, Plan):
+        w = w.padded(N)
+    else:
+        w = h.zeropad(w, N)
     w_ = w[::-1].conj()
     X_pwd = []
     points = range(0, N)
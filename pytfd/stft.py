@@ -4,27 +4,41 @@ or more precisely the Discrete Time and Frequency STFT.
 from __future__ import division
 
 from numpy import *
+from numpy.lib.stride_tricks import as_strided
 from scipy.fftpack import rfft
 
-from pytfd import helpers as h
+from pytfd.plans import Plan
 
-def stft(x, w, L=None):
+def stft(x, w, L=None, hop=None):
     # L is the overlap, see http://cnx.org/content/m10570/latest/
+    # hop is the distance between frames and overrides L
+    # w is a window or a pytfd.plans.Plan, whose scratch buffer is reused
+    plan = w if isinstance(w, Plan) else None
+    if plan is not None:
+        w = plan.window
     N = len(x)
     T = len(w)
-    if L is None:
-        L = N
-    X_stft = []
-    points = range(0, N, N//L)
-    for i in points:
-        x_subset = h.subset(x, i, T)
-        fft_subset = rfft(x_subset * w)
-        X_stft.append(fft_subset)
-    X_stft = array(X_stft).transpose()
-    return X_stft
+    assert T <= N
+    if hop is None:
+        if L is None:
+            L = N
+        hop = N//L
+    # frame i is centered on x[i*hop], zero padded at the edges like
+    # helpers.subset; all frames are strided views of one padded copy
+    padded = zeros(N + T, result_type(x, w))
+    padded[T//2:T//2 + N] = x
+    count = (N - 1)//hop + 1
+    step = padded.strides[0]
+    frames = as_strided(padded, (count, T), (hop*step, step))
+    if plan is not None:
+        windowed = plan.scratch('stft', (count, T))
+    else:
+        windowed = empty((count, T), padded.dtype)
+    multiply(frames, w, out=windowed)
+    return rfft(windowed, axis=-1).transpose()
 
-def spec(x, w):
-    return abs(stft(x, w))
+def spec(x, w, L=None, hop=None):
+    return abs(stft(x, w, L, hop))
 
 spectogram = spec
 
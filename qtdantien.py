@@ -8,6 +8,7 @@ class Spectrogram (QtGui.QWidget):
 
         self.setGeometry(300, 300, 250, 150)
         self.model = model
+        self.model.subscribe('spectrogram')
         self.text = u''
 
     def paintEvent(self, event):
@@ -16,7 +17,8 @@ class Spectrogram (QtGui.QWidget):
         paint.setPen(QtGui.QColor(168, 34, 3))
         paint.setFont(QtGui.QFont('Decorative', 10))
         paint.drawText(event.rect(), QtCore.Qt.AlignCenter, self.text)
-        paint.drawImage(0,0,array2qimage(self.model.dat_s, True))
+        paint.drawImage(0,0,array2qimage(self.model.dat_s[0][::-1],
+                normalize=self.model.spectrogram_range))
         paint.end()
 
 class Dantien(QtGui.QMainWindow):
@@ -42,12 +44,14 @@ if __name__ == '__main__':
     import feeders, sys
     from model import TimeSeries
 
+    channels = 1
     if len(sys.argv) >= 2 and sys.argv[1] == '--modeeg':
         feed = feeders.mk_modeeg(sys.stdin) # read modeeg data from stdin
+        channels = feeders.MODEEG_CHANNELS
     else:
         feed = feeders.random_positive_sinoids
 
     app = QtGui.QApplication(['Dantien'])
-    window = Dantien(TimeSeries(feed))
+    window = Dantien(TimeSeries(feed, channels))
     window.show()
     app.exec_()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Chunked, compressed on-disk format for recorded EEG sessions.
+
+A recording starts with a header, followed by chunks of at most `chunk_len`
+samples. Every chunk stores the samples of all channels, the packet
+counters and the acquisition timestamps, compressed with zlib or lzma. An
+index of all chunks is appended when the recording is closed, so readers
+only decompress the chunks a query touches. Recordings that were not
+closed properly are indexed by walking the chunk headers instead.
+"""
+import struct
+import time
+import zlib
+import numpy as np
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+MAGIC = b'DANTIEN\x01'
+HEADER = struct.Struct('<8sHdIB8s')
+CHUNK = struct.Struct('<4sIIqdd')
+CHUNK_MAGIC = b'CHNK'
+TRAILER = struct.Struct('<qI4s')
+TRAILER_MAGIC = b'INDX'
+
+COMPRESSION = {'none': 0, 'zlib': 1, 'lzma': 2}
+
+INDEX = np.dtype([
+    ('offset', '<i8'), # file offset of the chunk header
+    ('start', '<i8'),  # index of the first sample in the chunk
+    ('length', '<u4'),
+    ('t0', '<f8'),     # acquisition time of the first and last sample
+    ('t1', '<f8'),
+])
+
+def _compress(method, data):
+    if method == COMPRESSION['zlib']:
+        return zlib.compress(data, 6)
+    if method == COMPRESSION['lzma']:
+        return lzma.compress(data)
+    return data
+
+def _decompress(method, data):
+    if method == COMPRESSION['zlib']:
+        return zlib.decompress(data)
+    if method == COMPRESSION['lzma']:
+        return lzma.decompress(data)
+    return data
+
+class RecordingWriter(object):
+    """
+    Append samples to a new recording. Samples are buffered and written
+    out one compressed chunk at a time.
+    """
+
+    def __init__(self, path, channels, rate=256.0, dtype=np.uint16,
+                 chunk_len=4096, compression='zlib'):
+        if compression == 'lzma' and lzma is None:
+            raise ValueError("lzma compression is not available")
+        self.channels = channels
+        self.rate = rate
+        self.dtype = np.dtype(dtype)
+        self.chunk_len = chunk_len
+        self.compression = COMPRESSION[compression]
+        self.f = open(path, 'wb')
+        self.f.write(HEADER.pack(MAGIC, channels, rate, chunk_len,
+                                 self.compression,
+                                 self.dtype.str.encode('ascii')))
+        self.index = []
+        self.written = 0
+        self.samples = np.zeros((chunk_len, channels), dtype=self.dtype)
+        self.counters = np.zeros(chunk_len, dtype=np.uint8)
+        self.times = np.zeros(chunk_len, dtype=np.float64)
+        self.fill = 0
+
+    def write(self, samples, counters=None, timestamp=None):
+        """
+        Add a (n, channels) block. `timestamp` is the acquisition time of
+        the last sample, either a scalar or one value per sample; it
+        defaults to now.
+        """
+        n = len(samples)
+        if timestamp is None:
+            timestamp = time.time()
+        if np.isscalar(timestamp):
+            timestamp = timestamp - np.arange(n - 1, -1, -1) / self.rate
+        if counters is None:
+            counters = (self.written + self.fill + np.arange(n)) % 256
+        i = 0
+        while i < n:
+            k = min(n - i, self.chunk_len - self.fill)
+            self.samples[self.fill:self.fill + k] = samples[i:i + k]
+            self.counters[self.fill:self.fill + k] = counters[i:i + k]
+            self.times[self.fill:self.fill + k] = timestamp[i:i + k]
+            self.fill += k
+            i += k
+            if self.fill == self.chunk_len:
+                self.flush()
+
+    def flush(self):
+        " Write out the current, possibly partial, chunk "
+        n = self.fill
+        if n == 0:
+            return
+        t0 = self.times[0]
+        # timestamps are stored as microsecond offsets from the chunk start
+        offsets = np.round((self.times[:n] - t0) * 1e6).astype('<i4')
+        payload = _compress(self.compression,
+                            self.samples[:n].tobytes() +
+                            self.counters[:n].tobytes() +
+                            offsets.tobytes())
+        offset = self.f.tell()
+        self.f.write(CHUNK.pack(CHUNK_MAGIC, n, len(payload), self.written,
+                                t0, self.times[n - 1]))
+        self.f.write(payload)
+        self.index.append((offset, self.written, n, t0, self.times[n - 1]))
+        self.written += n
+        self.fill = 0
+
+    def close(self):
+        self.flush()
+        index = np.array(self.index, dtype=INDEX)
+        offset = self.f.tell()
+        self.f.write(index.tobytes())
+        self.f.write(TRAILER.pack(offset, len(index), TRAILER_MAGIC))
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class RecordingReader(object):
+    """
+    Random access to a recording. read() and read_time() decompress only
+    the chunks overlapping the requested range.
+    """
+
+    def __init__(self, path):
+        self.f = open(path, 'rb')
+        magic, self.channels, self.rate, self.chunk_len, self.compression, \
+            dtype = HEADER.unpack(self.f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("%s is not a dantien recording" % path)
+        self.dtype = np.dtype(dtype.rstrip(b'\0').decode('ascii'))
+        self.index = self._read_index()
+        self._cache = (None, None)
+
+    def _read_index(self):
+        self.f.seek(0, 2)
+        size = self.f.tell()
+        if size >= HEADER.size + TRAILER.size:
+            self.f.seek(size - TRAILER.size)
+            offset, count, magic = TRAILER.unpack(self.f.read(TRAILER.size))
+            if magic == TRAILER_MAGIC:
+                self.f.seek(offset)
+                return np.frombuffer(self.f.read(count * INDEX.itemsize),
+                                     dtype=INDEX)
+        return self._scan_index(size)
+
+    def _scan_index(self, size):
+        " Rebuild the index of an unterminated recording from chunk headers "
+        index = []
+        offset = HEADER.size
+        while offset + CHUNK.size <= size:
+            self.f.seek(offset)
+            magic, n, length, start, t0, t1 = \
+                CHUNK.unpack(self.f.read(CHUNK.size))
+            if magic != CHUNK_MAGIC or offset + CHUNK.size + length > size:
+                break
+            index.append((offset, start, n, t0, t1))
+            offset += CHUNK.size + length
+        return np.array(index, dtype=INDEX)
+
+    def __len__(self):
+        if len(self.index) == 0:
+            return 0
+        return int(self.index['start'][-1] + self.index['length'][-1])
+
+    @property
+    def duration(self):
+        return len(self) / self.rate
+
+    def chunk(self, i):
+        " Samples, counters and timestamps of chunk i "
+        if self._cache[0] == i:
+            return self._cache[1]
+        entry = self.index[i]
+        self.f.seek(entry['offset'])
+        _, n, length, _, t0, _ = CHUNK.unpack(self.f.read(CHUNK.size))
+        data = _decompress(self.compression, self.f.read(length))
+        size = n * self.channels * self.dtype.itemsize
+        samples = np.frombuffer(data, dtype=self.dtype, count=n * self.channels)
+        counters = np.frombuffer(data, dtype=np.uint8, count=n, offset=size)
+        offsets = np.frombuffer(data, dtype='<i4', count=n, offset=size + n)
+        result = (samples.reshape(n, self.channels), counters,
+                  t0 + offsets / 1e6)
+        self._cache = (i, result)
+        return result
+
+    def read(self, start, stop):
+        """
+        Samples start..stop (sample indices) as a tuple of samples,
+        counters and timestamps.
+        """
+        start, stop = max(start, 0), min(stop, len(self))
+        starts = self.index['start']
+        first = np.searchsorted(starts, start, side='right') - 1
+        last = np.searchsorted(starts, stop, side='left')
+        parts = []
+        for i in range(max(first, 0), last):
+            samples, counters, times = self.chunk(i)
+            lo = max(start - starts[i], 0)
+            hi = min(stop - starts[i], len(samples))
+            parts.append((samples[lo:hi], counters[lo:hi], times[lo:hi]))
+        if not parts:
+            return (np.zeros((0, self.channels), dtype=self.dtype),
+                    np.zeros(0, dtype=np.uint8), np.zeros(0))
+        return tuple(np.concatenate(p) for p in zip(*parts))
+
+    def read_time(self, t0, t1):
+        " Samples acquired between the timestamps t0 and t1 "
+        first = np.searchsorted(self.index['t1'], t0, side='left')
+        last = np.searchsorted(self.index['t0'], t1, side='right')
+        if first >= last:
+            return self.read(0, 0)
+        samples, counters, times = self.read(
+            int(self.index['start'][first]),
+            int(self.index['start'][last - 1] + self.index['length'][last - 1]))
+        keep = (times >= t0) & (times < t1)
+        return samples[keep], counters[keep], times[keep]
+
+    def close(self):
+        self.f.close()
+
+def record_modeeg(read, path, **kwargs):
+    """
+    Decode a raw ModEEG stream and record it until read, a function that
+    returns the next chunk of bytes, returns an empty string.
+    """
+    from feeders import ModEEGDecoder, MODEEG_CHANNELS, MODEEG_RATE
+    decoder = ModEEGDecoder()
+    with RecordingWriter(path, MODEEG_CHANNELS, MODEEG_RATE, **kwargs) as rec:
+        while True:
+            data = read()
+            if not data:
+                break
+            now = time.time()
+            packets = decoder.decode(data)
+            if len(packets):
+                rec.write(packets['channels'], packets['counter'], now)
+
+if __name__ == '__main__':
+    import io
+    import sys
+    import argparse
+    parser = argparse.ArgumentParser(
+            description='Record a raw ModEEG stream')
+    parser.add_argument('output')
+    parser.add_argument('--serial', metavar='DEVICE',
+            help='record straight from a serial device instead')
+    parser.add_argument('--compression', default='zlib',
+            choices=sorted(COMPRESSION))
+    parser.add_argument('--chunk', type=int, default=4096,
+            help='samples per chunk')
+    args = parser.parse_args()
+    if args.serial:
+        from feeders import SerialFeeder
+        read = SerialFeeder(args.serial).read_raw
+    else:
+        read = io.open(sys.stdin.fileno(), mode='rb', closefd=False).read1
+    record_modeeg(read, args.output, chunk_len=args.chunk,
+                  compression=args.compression)
@@ -10,15 +10,41 @@ import OpenGL.GLU as glu
 from glumpy import figure, show, Trackball
 from glumpy.graphics import VertexBuffer
 
+from model import BRAINWAVES
+
 THEME_BG = (0.01, 0.03, 0.05, 1)
 THEME_FG = (0.0, 0.4, 0.8, 1)
 
 class BaseView(object):
-    def __init__(self, fig, ts, size=0.5):
+    img_s = None
+    products = () # what the view reads from the model, see subscribe()
+
+    def __init__(self, fig, ts, size=0.5, channel=0):
         self.ts = ts
+        self.channel = channel
         self.fig = fig
+        self.subscribe()
         self.fig.push(self)
 
+    def subscribe(self):
+        " Have the model compute the products this view reads "
+        for product in self.products:
+            self.ts.subscribe(product)
+
+    def image(self, ring, **kwargs):
+        """
+        The image showing this view's channel of ring. The texture is
+        built once and then refilled straight from the float32 ring
+        buffer; clipping to vmin/vmax happens on the GPU.
+        """
+        data = ring.buf[self.channel]
+        if self.img_s is None:
+            self.img_s = glumpy.image.Image(data, colormap=self.colormap,
+                    **kwargs)
+        else:
+            self.img_s.update(data)
+        return self.img_s
+
 class Blank(BaseView):
     def on_draw(self):
         self.fig.lock()
@@ -56,14 +82,24 @@ class Plot(BaseView):
 
 class SeriesPlot(Plot):
     min, max = -1, 1
+    products = ('series',)
     def get_series(self):
-        return self.ts.series
+        return self.ts.series[:, self.channel]
 
 
 class FFTPlot(Plot):
     min, max = 0, 30
+    products = ('spectrogram',)
     def get_series(self):
-        return self.ts.dat_s[:,-1]
+        return self.ts.spectrogram.last(1)[self.channel][::-1,0]
+
+
+class BandPowerPlot(Plot):
+    " Current power of every band in ts.bands "
+    min, max = 0, 50
+    products = ('bands',)
+    def get_series(self):
+        return self.ts.band_power.last(1)[self.channel][:,0]
 
 
 from glfreetype import glFreeType
@@ -72,20 +108,16 @@ class SpectrogramAxis(BaseView):
     colormap = glumpy.colormap.Hot
     text_vertical_dist = 25.0
     text_size = 12
-    brainwaves = [
-            ('delta', 0.5, 4.0),
-            ('theta', 4.0, 8.0),
-            ('alpha', 8.0, 14.0),
-            ('beta', 14.0, 30.0)
-        ]
-
-    def __init__(self, fig, ts, size=0.5, colormap=None):
+    brainwaves = BRAINWAVES
+
+    def __init__(self, fig, ts, size=0.5, colormap=None, channel=0):
         self.fig = fig
         self.ts = ts
+        self.channel = channel
         if not colormap is None: self.colormap = colormap
         self.font = glFreeType.font_data ("glfreetype/test.ttf", self.text_size)
-        self.window_len = self.ts.dat_s.shape[1]
-        self.freqs = np.fft.fftfreq(self.window_len, 1/33.0)[:self.window_len/2]
+        self.window_len = self.ts.buffer_len
+        self.freqs = self.ts.freqs[:self.ts.window_size // 2]
 
         self.fig.push(self)
 
@@ -109,25 +141,29 @@ class SpectrogramAxis(BaseView):
         self.fig.unlock()
 
 
-class Spectrogram(object):
+class Spectrogram(BaseView):
     colormap = glumpy.colormap.Hot
     text_size = 12
     num_freqs = 10
+    products = ('spectrogram',)
 
-    def __init__(self, fig, ts, size=0.5, colormap=None):
+    def __init__(self, fig, ts, size=0.5, colormap=None, channel=0):
         self.fig = fig
         self.ts = ts
+        self.channel = channel
         if not colormap is None: self.colormap = colormap
+        self.subscribe()
         self.fig.push(self)
 
     def on_draw(self):
         self.fig.lock()
         self.fig.clear(*THEME_BG)
 
-        if self.ts.dat_s != None:
-            self.img_s = glumpy.image.Image(self.ts.dat_s.astype(np.float32), colormap=self.colormap)
-            self.img_s.update()
-            self.img_s.draw( x=-self.ts.samples_since_last_update()/self.ts.buffer_len, y=0, z=0, width=self.fig.width, height=self.fig.height )
+        spect = self.ts.spectrogram
+        vmin, vmax = self.ts.spectrogram_range
+        self.image(spect, vmin=vmin, vmax=vmax).draw(
+                x=-self.ts.samples_since_last_update()/self.ts.buffer_len, y=0, z=0, width=self.fig.width, height=self.fig.height,
+                offset=(spect.cursor / float(spect.length), 0.0), flip=(False, True) )
 
         gl.glLoadIdentity ()
         #print self.ts.freqs
@@ -144,7 +180,7 @@ class Spectrogram3D(Spectrogram):
     def on_draw(self):
         self.fig.lock()
         self.fig.clear(*THEME_BG)
-        spect = self.ts.dat_s.astype(np.float32)
+        spect = self.ts.spectrogram
 
         self.i = self.i + 1
         xxx = np.sin(self.i/30.0)
@@ -159,31 +195,32 @@ class Spectrogram3D(Spectrogram):
         gl.glMatrixMode(gl.GL_MODELVIEW)
         gl.glLoadIdentity()
 
-        if self.ts.dat_s != None:
-            self.img_s = glumpy.image.Image(spect, colormap=self.colormap)
-            self.img_s.update()
-            self.img_s.draw( x=0, y=0, z=0, width=1, height=1)
+        vmin, vmax = self.ts.spectrogram_range
+        self.image(spect, vmin=vmin, vmax=vmax).draw( x=0, y=0, z=0, width=1, height=1,
+                offset=(spect.cursor / float(spect.length), 0.0), flip=(False, True) )
         self.fig.unlock()
 
 
 class Scaleogram(BaseView):
     colormap = glumpy.colormap.IceAndFire
+    products = ('scaleogram',)
 
-    def __init__(self, fig, ts, size=0.5, colormap=None):
+    def __init__(self, fig, ts, size=0.5, colormap=None, channel=0):
         self.fig = fig
         self.ts = ts
+        self.channel = channel
         if not colormap is None: self.colormap = colormap
+        self.subscribe()
         self.fig.push(self)
 
     def on_draw(self):
         self.fig.lock()
         self.fig.clear(*THEME_BG)
-        if self.ts.dat_s != None:
-            self.img_s = glumpy.image.Image(self.ts.dat_w.astype(np.float32), 
-                    interpolation='bilinear',
-                    colormap=self.colormap)
-            self.img_s.update()
-            self.img_s.draw( x=-self.ts.samples_since_last_update()*self.fig.width*0.00002 , y=0, z=0, width=self.fig.width, height=self.fig.height )
+        scal = self.ts.scaleogram
+        vmin, vmax = self.ts.scaleogram_range
+        self.image(scal, interpolation='bilinear', vmin=vmin, vmax=vmax).draw(
+                x=-self.ts.samples_since_last_update()*self.fig.width*0.00002 , y=0, z=0, width=self.fig.width, height=self.fig.height,
+                offset=(scal.cursor / float(scal.length), 0.0), flip=(False, True) )
         self.fig.unlock()
 
 